@@ -3,7 +3,9 @@ import time
 import logging
 from flask import Flask, request, jsonify
 from werkzeug.middleware.proxy_fix import ProxyFix
-from routes import bp as routes_bp
+from routes import bp as routes_bp, collect_precompute_stats, released_paths
+from utils.artifact_registry import create_registry
+from utils.precompute import Precomputer
 
 # ── Logging ────────────────────────────────────────────────────────────────────
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
@@ -14,8 +16,9 @@ app = Flask(__name__, template_folder="templates", static_folder="static")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
 # ── Stockage éphémère Cloud Run (/tmp uniquement) ─────────────────────────────
-UPLOAD_DIR = "/tmp/uploads"
-PROCESSED_DIR = "/tmp/processed"
+# Surchargeables (ex. dossiers isolés pour bench.loadtest)
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "/tmp/uploads")
+PROCESSED_DIR = os.environ.get("PROCESSED_DIR", "/tmp/processed")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(PROCESSED_DIR, exist_ok=True)
 
@@ -25,8 +28,45 @@ app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_MB", "50")) *
 
 # TTL (durée de vie) des fichiers éphémères pour le petit garbage collector
 TMP_TTL_SECONDS = int(os.environ.get("TMP_TTL_SECONDS", "1800"))  # 30 min par défaut
+# Balayage complet du disque (fichiers orphelins hors registre), au plus une fois par période
+TMP_SWEEP_SECONDS = int(os.environ.get("TMP_SWEEP_SECONDS", "300"))
+
+# ── Registre des fichiers (uploads, previews, sorties) ────────────────────────
+# ARTIFACT_DB=/tmp/artifacts.sqlite3 pour partager le registre entre workers
+registry = create_registry(os.environ.get("ARTIFACT_DB"))
+app.extensions["artifact_registry"] = registry
+
+# ── Précalcul spéculatif des crops par défaut ─────────────────────────────────
+# Par défaut, on ne précalcule que si un thread de requête du worker reste libre
+# en plus de celui qui planifie (1 thread : tout autre trafic suspend le précalcul)
+GUNICORN_THREADS = int(os.environ.get("GUNICORN_THREADS", "1"))
+precomputer = Precomputer(
+    enabled=os.environ.get("PRECOMPUTE_ENABLED", "1") == "1",
+    max_workers=int(os.environ.get("PRECOMPUTE_WORKERS", "1")),
+    max_pending=int(os.environ.get("PRECOMPUTE_MAX_PENDING", "4")),
+    max_active_requests=int(os.environ.get("PRECOMPUTE_MAX_ACTIVE_REQUESTS", max(0, GUNICORN_THREADS - 2))),
+    max_load=float(os.environ.get("PRECOMPUTE_MAX_LOAD", "0.75")),
+    ttl_seconds=TMP_TTL_SECONDS,
+    # compteurs publiés dans le registre : /precompute/stats somme tous les workers
+    publish=registry.publish_worker_stats,
+)
+app.extensions["precomputer"] = precomputer
+
+@app.before_request
+def _track_request_start():
+    precomputer.request_started()
+
+@app.teardown_request
+def _track_request_end(exc):
+    precomputer.request_finished()
 
 # ── GC des fichiers temporaires ────────────────────────────────────────────────
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except Exception:
+        pass
+
 def _gc_tmp(root: str, ttl_seconds: int) -> None:
     """Supprime silencieusement les fichiers plus vieux que ttl_seconds."""
     now = time.time()
@@ -42,11 +82,21 @@ def _gc_tmp(root: str, ttl_seconds: int) -> None:
     except Exception:
         pass
 
+_last_sweep = 0.0
+
 @app.before_request
 def _gc_hook():
-    # petit ménage avant chaque requête
-    _gc_tmp(UPLOAD_DIR, TMP_TTL_SECONDS)
-    _gc_tmp(PROCESSED_DIR, TMP_TTL_SECONDS)
+    # petit ménage avant chaque requête : recherche dans le registre,
+    # et balayage complet du disque seulement toutes les TMP_SWEEP_SECONDS
+    global _last_sweep
+    for path in released_paths(registry.expire(TMP_TTL_SECONDS), precomputer):
+        _remove_quietly(path)
+
+    now = time.time()
+    if now - _last_sweep >= TMP_SWEEP_SECONDS:
+        _last_sweep = now
+        _gc_tmp(UPLOAD_DIR, TMP_TTL_SECONDS)
+        _gc_tmp(PROCESSED_DIR, TMP_TTL_SECONDS)
 
 # ── Anti-cache pour les binaires (preview/download) ───────────────────────────
 API_PREFIX = "/api"
@@ -83,6 +133,7 @@ def health():
         "upload_dir": UPLOAD_DIR,
         "processed_dir": PROCESSED_DIR,
         "ttl_seconds": TMP_TTL_SECONDS,
+        "precompute": collect_precompute_stats(registry, precomputer),
     }
 
 # ── Local dev ─────────────────────────────────────────────────────────────────
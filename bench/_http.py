@@ -0,0 +1,77 @@
+"""Petit client HTTP (stdlib uniquement) partagé par les scripts de bench."""
+import io
+import json
+import mimetypes
+import os
+import socket
+import time
+import uuid
+import urllib.error
+import urllib.request
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def encode_multipart(field: str, filepath: str, data: bytes = None):
+    """Encode un fichier (ou data, déjà lu) en multipart/form-data ; renvoie (body, content_type)."""
+    boundary = uuid.uuid4().hex
+    filename = os.path.basename(filepath)
+    ctype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    buf = io.BytesIO()
+    buf.write(f"--{boundary}\r\n".encode())
+    buf.write(f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'.encode())
+    buf.write(f"Content-Type: {ctype}\r\n\r\n".encode())
+    if data is None:
+        with open(filepath, "rb") as f:
+            data = f.read()
+    buf.write(data)
+    buf.write(f"\r\n--{boundary}--\r\n".encode())
+    return buf.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+def request(method: str, url: str, body: bytes = None, headers: dict = None, timeout: float = 120.0):
+    """Renvoie (status, bytes). Les erreurs HTTP ne lèvent pas d'exception."""
+    req = urllib.request.Request(url, data=body, method=method, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def post_json(url: str, payload: dict, timeout: float = 120.0):
+    status, raw = request(
+        "POST", url, json.dumps(payload).encode(), {"Content-Type": "application/json"}, timeout
+    )
+    try:
+        return status, json.loads(raw or b"{}")
+    except ValueError:
+        return status, {}
+
+
+def upload(base_url: str, filepath: str, timeout: float = 120.0):
+    body, ctype = encode_multipart("file", filepath)
+    status, raw = request("POST", f"{base_url}/api/upload", body, {"Content-Type": ctype}, timeout)
+    try:
+        return status, json.loads(raw or b"{}")
+    except ValueError:
+        return status, {}
+
+
+def wait_until_healthy(base_url: str, deadline: float, proc=None) -> bool:
+    """Interroge /api/health jusqu'à 200 (ou fin du process / échéance)."""
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            return False
+        try:
+            status, _ = request("GET", f"{base_url}/api/health", timeout=1.0)
+            if status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.02)
+    return False
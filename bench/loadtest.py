@@ -0,0 +1,493 @@
+"""
+Test de charge local de l'app réelle sous gunicorn.
+
+Pour chaque configuration (workers x threads x MAX_UPLOAD_MB), lance
+gunicorn avec gunicorn_config.py puis, pour chaque niveau de concurrence,
+fait tourner N clients en parallèle pendant une durée fixe. Chaque client
+enchaîne des sessions comme le front :
+    upload -> preview -> process -> download -> cleanup
+sur un fichier tiré du corpus, avec des réglages par défaut (précalcul)
+ou modifiés (focus / zoom / max_edge aléatoires).
+
+Rapport : latences p50/p95/p99 par endpoint, débit, taux d'erreur (et
+codes HTTP), RSS des workers gunicorn au fil du temps (/proc, Linux).
+
+Usage :
+    python -m bench.loadtest --corpus photos/ --concurrency 1,4,8 --duration 30 \\
+        --workers 1,2 --threads 1,4 --max-upload-mb 50 [--json results.json]
+"""
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+from bench._http import encode_multipart, free_port, post_json, request, wait_until_healthy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = ["upload", "preview", "process", "download", "cleanup"]
+# Mêmes extensions que routes.ALLOWED_EXTENSIONS (sans importer l'app côté client)
+CORPUS_EXTENSIONS = {".tiff", ".tif", ".png", ".jpg", ".jpeg", ".heic", ".heif", ".webp"}
+MB = 1024 * 1024
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# Corpus
+# ────────────────────────────────────────────────────────────────────────────────
+
+def load_corpus(paths):
+    """Fichiers (ou dossiers) -> [(nom, taille, body multipart, content_type)], lus une seule fois"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.splitext(name)[1].lower() in CORPUS_EXTENSIONS:
+                    files.append(os.path.join(path, name))
+        else:
+            files.append(path)
+    if not files:
+        raise SystemExit("Empty corpus")
+
+    corpus = []
+    for filepath in files:
+        with open(filepath, "rb") as f:
+            data = f.read()
+        body, ctype = encode_multipart("file", filepath, data)
+        corpus.append((os.path.basename(filepath), len(data), body, ctype))
+    return corpus
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# RSS des workers (Linux : /proc)
+# ────────────────────────────────────────────────────────────────────────────────
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        pass
+    # Noyau sans CONFIG_PROC_CHILDREN : parcours de /proc
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # le nom du process (champ 2) peut contenir des espaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler(threading.Thread):
+    """Échantillonne la RSS du master gunicorn et de ses workers toutes les interval secondes"""
+
+    def __init__(self, master_pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.samples = []  # (t monotonic, rss master, {pid worker: rss})
+        self.available = os.path.isdir("/proc")
+        self._done = threading.Event()
+
+    def run(self):
+        while self.available and not self._done.is_set():
+            workers = {}
+            for pid in _children(self.master_pid):
+                rss = _rss_bytes(pid)
+                if rss is not None:
+                    workers[pid] = rss
+            self.samples.append((time.monotonic(), _rss_bytes(self.master_pid), workers))
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join(timeout=5)
+
+    def window(self, start, end):
+        return [s for s in self.samples if start <= s[0] <= end]
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# Trafic
+# ────────────────────────────────────────────────────────────────────────────────
+
+class Recorder:
+    """Latences et statuts par endpoint (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.sessions = 0
+
+    def add(self, endpoint, seconds, status):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+
+    def session_done(self):
+        with self._lock:
+            self.sessions += 1
+
+
+def _timed(recorder, endpoint, fn):
+    start = time.perf_counter()
+    try:
+        status, payload = fn()
+    except TimeoutError:
+        status, payload = "timeout", None
+    except OSError:
+        # connexion refusée / réinitialisée ; gunicorn coupe aussi la connexion
+        # quand un upload dépasse MAX_UPLOAD_MB avant la fin de l'envoi (413)
+        status, payload = "conn-error", None
+    except http.client.HTTPException as e:
+        # réponse tronquée ou invalide (IncompleteRead...) : le client continue
+        status, payload = f"http-error:{type(e).__name__}", None
+    recorder.add(endpoint, time.perf_counter() - start, status)
+    return status, payload
+
+
+def _json(raw):
+    try:
+        return json.loads(raw or b"{}")
+    except ValueError:
+        return {}
+
+
+def _process_params(rng, default_share, max_edge_share):
+    """Réglages du front : par défaut (précalculables) ou modifiés par l'utilisateur"""
+    params = {"orientation": rng.choice(["portrait", "landscape"])}
+    if rng.random() >= default_share:
+        params.update(
+            focus_x=round(rng.uniform(0.2, 0.8), 3),
+            focus_y=round(rng.uniform(0.2, 0.8), 3),
+            zoom=round(rng.uniform(1.0, 2.5), 2),
+        )
+        if rng.random() < max_edge_share:
+            params["max_edge"] = rng.choice([1080, 2048, 4096])
+    return params
+
+
+def run_session(base_url, corpus, recorder, rng, args):
+    name, _, body, ctype = rng.choice(corpus)
+    status, raw = _timed(recorder, "upload", lambda: request(
+        "POST", f"{base_url}/api/upload", body, {"Content-Type": ctype}, args.timeout))
+    data = _json(raw) if status == 200 else {}
+    filename = data.get("filename")
+    if not filename:
+        recorder.session_done()
+        return
+
+    preview = data.get("preview_filename") or filename
+    for _ in range(args.previews):
+        _timed(recorder, "preview", lambda: request("GET", f"{base_url}/api/preview/{preview}", timeout=args.timeout))
+
+    params = _process_params(rng, args.default_share, args.max_edge_share)
+    status, data = _timed(recorder, "process", lambda: post_json(
+        f"{base_url}/api/process", {"filename": filename, **params}, args.timeout))
+    output = (data or {}).get("output_filename") if status == 200 else None
+    if output:
+        _timed(recorder, "download", lambda: request("GET", f"{base_url}/api/download/{output}", timeout=args.timeout))
+
+    _timed(recorder, "cleanup", lambda: post_json(
+        f"{base_url}/api/cleanup", {"filenames": [filename]}, args.timeout))
+    recorder.session_done()
+
+
+def run_level(base_url, corpus, concurrency, duration, args, seed):
+    """concurrency clients enchaînent des sessions jusqu'à l'échéance"""
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        while time.monotonic() < deadline:
+            run_session(base_url, corpus, recorder, rng, args)
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder, start, time.monotonic()
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# Statistiques / rapport
+# ────────────────────────────────────────────────────────────────────────────────
+
+def percentile(values, p):
+    """Rang le plus proche (valeurs triées)"""
+    if not values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+def summarize_level(recorder, start, end, samples):
+    elapsed = end - start
+    endpoints = {}
+    total = errors = 0
+    for endpoint in ENDPOINTS:
+        values = sorted(recorder.latencies.get(endpoint, []))
+        if not values:
+            continue
+        statuses = recorder.statuses[endpoint]
+        failed = sum(n for code, n in statuses.items() if not (isinstance(code, int) and 200 <= code < 300))
+        total += len(values)
+        errors += failed
+        endpoints[endpoint] = {
+            "count": len(values),
+            "errors": failed,
+            "error_rate": round(failed / len(values), 4),
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p95_ms": round(percentile(values, 95) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1),
+            "max_ms": round(values[-1] * 1000, 1),
+            "statuses": {str(code): n for code, n in sorted(statuses.items(), key=lambda item: str(item[0]))},
+        }
+
+    timeline = [
+        {
+            "t": round(t - start, 2),
+            "master_mb": round((master or 0) / MB, 1),
+            "workers_mb": {str(pid): round(rss / MB, 1) for pid, rss in sorted(workers.items())},
+        }
+        for t, master, workers in samples
+    ]
+    per_worker = [rss for _, _, workers in samples for rss in workers.values()]
+    totals = [sum(workers.values()) for _, _, workers in samples if workers]
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "sessions": recorder.sessions,
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else None,
+        "requests_per_s": round(total / elapsed, 2) if elapsed else None,
+        "sessions_per_s": round(recorder.sessions / elapsed, 3) if elapsed else None,
+        "endpoints": endpoints,
+        "rss": {
+            "worker_peak_mb": round(max(per_worker) / MB, 1) if per_worker else None,
+            "worker_end_mb": round(max(samples[-1][2].values()) / MB, 1) if samples and samples[-1][2] else None,
+            "workers_total_peak_mb": round(max(totals) / MB, 1) if totals else None,
+            "timeline": timeline,
+        },
+    }
+
+
+def _ms(value):
+    return f"{value:8.1f}" if value is not None else f"{'-':>8}"
+
+
+def print_level(concurrency, summary, timeline_points):
+    print(
+        f"\n-- concurrency {concurrency}: {summary['elapsed_s']:.1f} s, {summary['sessions']} sessions, "
+        f"{summary['requests']} requests, {summary['requests_per_s']} req/s, "
+        f"{summary['sessions_per_s']} sessions/s, errors {summary['errors']}"
+    )
+    print(f"  {'endpoint':<10} {'count':>6} {'err%':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+    for endpoint, s in summary["endpoints"].items():
+        statuses = ", ".join(f"{code}: {n}" for code, n in s["statuses"].items())
+        print(
+            f"  {endpoint:<10} {s['count']:>6} {s['error_rate'] * 100:>6.1f} "
+            f"{_ms(s['p50_ms'])} {_ms(s['p95_ms'])} {_ms(s['p99_ms'])} {_ms(s['max_ms'])}  {statuses}"
+        )
+
+    rss = summary["rss"]
+    if not rss["timeline"]:
+        print("  worker RSS: unavailable (no /proc)")
+        return
+    print(
+        f"  worker RSS: peak {rss['worker_peak_mb']} MB, end {rss['worker_end_mb']} MB, "
+        f"all workers peak {rss['workers_total_peak_mb']} MB"
+    )
+    # Courbe résumée : RSS max d'un worker à quelques instants répartis
+    timeline = rss["timeline"]
+    step = max(1, math.ceil(len(timeline) / timeline_points))
+    points = [
+        f"{p['t']:.1f}s {max(p['workers_mb'].values()):.0f}"
+        for p in timeline[::step] if p["workers_mb"]
+    ]
+    print(f"  RSS over time (max worker, MB): {' | '.join(points)}")
+
+
+def print_comparison(results):
+    print("\n== Comparison")
+    print(
+        f"  {'config':<22} {'conc':>4} {'req/s':>7} {'sess/s':>7} {'err%':>6} "
+        f"{'process p95':>11} {'upload p95':>10} {'worker RSS':>10} {'total RSS':>9}"
+    )
+    for result in results:
+        for level in result["levels"]:
+            s = level["summary"]
+            process = s["endpoints"].get("process", {})
+            upload = s["endpoints"].get("upload", {})
+            print(
+                f"  {result['label']:<22} {level['concurrency']:>4} {s['requests_per_s']:>7} "
+                f"{s['sessions_per_s']:>7} {(s['error_rate'] or 0) * 100:>6.1f} "
+                f"{process.get('p95_ms', '-'):>11} {upload.get('p95_ms', '-'):>10} "
+                f"{s['rss']['worker_peak_mb'] or '-':>10} {s['rss']['workers_total_peak_mb'] or '-':>9}"
+            )
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# gunicorn
+# ────────────────────────────────────────────────────────────────────────────────
+
+def start_server(workers, threads, max_upload_mb, tmp, gunicorn_args, log, timeout=60.0):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ)
+    env.setdefault("PYTHONDONTWRITEBYTECODE", "1")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env.update(
+        WEB_CONCURRENCY=str(workers),
+        GUNICORN_THREADS=str(threads),
+        MAX_UPLOAD_MB=str(max_upload_mb),
+        TMPDIR=tmp,
+        # dossiers propres à ce run : pas de fichiers ni de GC partagés
+        UPLOAD_DIR=os.path.join(tmp, "uploads"),
+        PROCESSED_DIR=os.path.join(tmp, "processed"),
+    )
+    if workers > 1:
+        # registre partagé propre à ce run (pas celui d'un run précédent)
+        env["ARTIFACT_DB"] = os.path.join(tmp, "artifacts.sqlite3")
+
+    cmd = [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn_config.py"),
+           "-b", f"127.0.0.1:{port}", *shlex.split(gunicorn_args), "app:app"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=log)
+    if not wait_until_healthy(base_url, time.monotonic() + timeout, proc):
+        proc.terminate()
+        proc.wait(timeout=10)
+        raise RuntimeError(f"gunicorn did not become healthy ({' '.join(cmd)})")
+    return proc, base_url
+
+
+def run_config(workers, threads, max_upload_mb, corpus, args):
+    label = f"w{workers} t{threads} {max_upload_mb}MB"
+    too_big = [name for name, size, _, _ in corpus if size > max_upload_mb * MB]
+    print(f"\n== {label} (WEB_CONCURRENCY={workers}, GUNICORN_THREADS={threads}, MAX_UPLOAD_MB={max_upload_mb})")
+    if too_big:
+        print(f"  {len(too_big)}/{len(corpus)} corpus files exceed MAX_UPLOAD_MB (expect 413): {', '.join(too_big[:5])}")
+
+    log = open(args.server_log, "ab") if args.server_log else subprocess.DEVNULL
+    levels = []
+    with tempfile.TemporaryDirectory() as tmp:
+        proc, base_url = start_server(workers, threads, max_upload_mb, tmp, args.gunicorn_args, log)
+        sampler = RssSampler(proc.pid, args.rss_interval)
+        sampler.start()
+        try:
+            # Sessions d'amorce hors mesure (imports paresseux, caches)
+            if args.warmup_sessions:
+                warmup = Recorder()
+                rng = random.Random(args.seed)
+                for _ in range(args.warmup_sessions):
+                    run_session(base_url, corpus, warmup, rng, args)
+
+            for index, concurrency in enumerate(args.concurrency):
+                recorder, start, end = run_level(
+                    base_url, corpus, concurrency, args.duration, args, args.seed + index
+                )
+                summary = summarize_level(recorder, start, end, sampler.window(start, end))
+                print_level(concurrency, summary, args.timeline_points)
+                levels.append({"concurrency": concurrency, "summary": summary})
+                if args.pause:
+                    time.sleep(args.pause)
+        finally:
+            sampler.stop()
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            if log is not subprocess.DEVNULL:
+                log.close()
+
+    return {
+        "label": label,
+        "workers": workers,
+        "threads": threads,
+        "max_upload_mb": max_upload_mb,
+        "levels": levels,
+    }
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", nargs="+", default=[os.path.join(ROOT, "test_image.jpg")],
+                        help="fichiers ou dossiers d'images")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4],
+                        help="niveaux de concurrence, ex. 1,4,8")
+    parser.add_argument("--duration", type=float, default=20.0, help="secondes par niveau")
+    parser.add_argument("--workers", type=_int_list, default=[2], help="WEB_CONCURRENCY à comparer, ex. 1,2")
+    parser.add_argument("--threads", type=_int_list, default=[1], help="GUNICORN_THREADS à comparer, ex. 1,4")
+    parser.add_argument("--max-upload-mb", type=_int_list, default=[50], help="MAX_UPLOAD_MB à comparer")
+    parser.add_argument("--previews", type=int, default=1, help="GET /preview par session")
+    parser.add_argument("--default-share", type=float, default=0.5,
+                        help="part des /process aux réglages par défaut (précalcul)")
+    parser.add_argument("--max-edge-share", type=float, default=0.3,
+                        help="part des /process modifiés avec max_edge")
+    parser.add_argument("--warmup-sessions", type=int, default=2)
+    parser.add_argument("--pause", type=float, default=1.0, help="pause entre niveaux (s)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="timeout client par requête (s)")
+    parser.add_argument("--rss-interval", type=float, default=0.5)
+    parser.add_argument("--timeline-points", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--gunicorn-args", default="", help="arguments gunicorn supplémentaires")
+    parser.add_argument("--server-log", help="ajoute les logs gunicorn à ce fichier")
+    parser.add_argument("--json", help="écrit les résultats (dont RSS au fil du temps) en JSON")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    sizes = sorted(size for _, size, _, _ in corpus)
+    print(
+        f"Corpus: {len(corpus)} files, {sizes[0] / MB:.1f}-{sizes[-1] / MB:.1f} MB; "
+        f"concurrency {args.concurrency}, {args.duration:.0f} s per level"
+    )
+
+    results = [
+        run_config(workers, threads, max_upload_mb, corpus, args)
+        for workers, threads, max_upload_mb in itertools.product(args.workers, args.threads, args.max_upload_mb)
+    ]
+    print_comparison(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items()}, "results": results}, f, indent=2)
+        print(f"\nResults written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
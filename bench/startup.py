@@ -0,0 +1,131 @@
+"""
+Benchmark de démarrage à froid.
+
+Mesure, sur des process neufs :
+  - le coût d'import de l'app et de ses dépendances lourdes ;
+  - sous gunicorn : le temps entre le lancement et la première réponse
+    /api/health, puis le premier /api/process réussi.
+
+Usage :
+    python -m bench.startup [--runs 5] [--image test_image.jpg] [--gunicorn-args "..."]
+"""
+import argparse
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench._http import free_port, post_json, upload, wait_until_healthy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = r"""
+import sys, time, json
+t0 = time.perf_counter()
+marks = {}
+def mark(name, stmt):
+    t = time.perf_counter()
+    exec(stmt, {})
+    marks[name] = time.perf_counter() - t
+mark("flask", "import flask")
+mark("PIL.Image", "from PIL import Image")
+mark("app", "import app")
+heif = "pillow_heif" in sys.modules
+cms = "PIL.ImageCms" in sys.modules
+mark("pillow_heif (lazy)", "import pillow_heif; pillow_heif.register_heif_opener()")
+mark("PIL.ImageCms (lazy)", "from PIL import ImageCms")
+marks["total"] = time.perf_counter() - t0
+print(json.dumps({"marks": marks, "heif_at_import": heif, "cms_at_import": cms}))
+"""
+
+
+def _env(tmp):
+    env = dict(os.environ)
+    env.setdefault("PYTHONDONTWRITEBYTECODE", "1")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["TMPDIR"] = tmp
+    # dossiers et registre propres à ce run : un vrai démarrage à froid, sans
+    # les fichiers ni le registre SQLite d'un run précédent
+    env["UPLOAD_DIR"] = os.path.join(tmp, "uploads")
+    env["PROCESSED_DIR"] = os.path.join(tmp, "processed")
+    env["ARTIFACT_DB"] = os.path.join(tmp, "artifacts.sqlite3")
+    return env
+
+
+def measure_imports(runs: int):
+    import json
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(runs):
+            out = subprocess.run(
+                [sys.executable, "-c", IMPORT_PROBE], cwd=ROOT, env=_env(tmp),
+                capture_output=True, text=True, check=True,
+            )
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def measure_first_process(image: str, gunicorn_args: str, timeout: float = 60.0):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    cmd = [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn_config.py"),
+           "-b", f"127.0.0.1:{port}", *shlex.split(gunicorn_args), "app:app"]
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.monotonic()
+        proc = subprocess.Popen(cmd, cwd=ROOT, env=_env(tmp),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            if not wait_until_healthy(base_url, t0 + timeout, proc):
+                raise RuntimeError("gunicorn did not become healthy")
+            t_health = time.monotonic() - t0
+
+            status, data = upload(base_url, image)
+            if status != 200:
+                raise RuntimeError(f"upload failed: {status} {data}")
+            t_upload = time.monotonic() - t0
+
+            status, data = post_json(f"{base_url}/api/process", {"filename": data["filename"]})
+            if status != 200 or not data.get("success"):
+                raise RuntimeError(f"process failed: {status} {data}")
+            t_process = time.monotonic() - t0
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+    return {"health": t_health, "upload": t_upload, "first_process": t_process}
+
+
+def _fmt(values):
+    ms = [v * 1000 for v in values]
+    return f"median {statistics.median(ms):8.1f} ms   min {min(ms):8.1f} ms   max {max(ms):8.1f} ms"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--image", default=os.path.join(ROOT, "test_image.jpg"))
+    parser.add_argument("--gunicorn-args", default="", help="arguments gunicorn supplémentaires")
+    parser.add_argument("--skip-gunicorn", action="store_true")
+    args = parser.parse_args(argv)
+
+    print(f"== Import cost ({args.runs} fresh interpreters)")
+    results = measure_imports(args.runs)
+    for name in results[0]["marks"]:
+        print(f"  {name:<22} {_fmt([r['marks'][name] for r in results])}")
+    print(f"  pillow_heif loaded at import: {results[0]['heif_at_import']}")
+    print(f"  ImageCms loaded at import:    {results[0]['cms_at_import']}")
+
+    if args.skip_gunicorn:
+        return 0
+
+    print(f"\n== gunicorn cold start ({args.runs} runs, args: {args.gunicorn_args or '<defaults>'})")
+    runs = [measure_first_process(args.image, args.gunicorn_args) for _ in range(args.runs)]
+    for key in ("health", "upload", "first_process"):
+        print(f"  {key:<22} {_fmt([r[key] for r in runs])}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
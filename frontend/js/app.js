@@ -10,6 +10,7 @@ let currentFilename = null;
 let currentPreviewFilename = null;
 let imageAspectRatio = 1;
 let cropOrientation = 'portrait';
+let precomputeCancelled = false;
 
 // DOM
 const fileInput = document.getElementById('file-input');
@@ -45,6 +46,7 @@ cameraInput.addEventListener('change', handleFileSelect);
 zoomSlider.addEventListener('input', updateCropOverlay);
 focusXSlider.addEventListener('input', updateCropOverlay);
 focusYSlider.addEventListener('input', updateCropOverlay);
+[zoomSlider, focusXSlider, focusYSlider].forEach(s => s.addEventListener('input', cancelPrecompute));
 processBtn.addEventListener('click', processImage);
 resetBtn.addEventListener('click', resetControls);
 reloadBtn.addEventListener('click', () => window.location.reload());
@@ -95,6 +97,7 @@ function handleFileSelect(evt) {
         return;
       }
       currentFilename = data.filename;
+      precomputeCancelled = false;
       currentPreviewFilename = data.preview_filename || data.filename;
       displayImageInfo(data.image_info);
       displayQualityIndicators(data.image_info);
@@ -216,6 +219,18 @@ function updateCropOverlay() {
   cropOverlay.style.top = `${top}px`;
 }
 
+// Le serveur précalcule les crops par défaut après l'upload :
+// dès qu'un réglage bouge, ils ne serviront plus.
+function cancelPrecompute() {
+  if (!currentFilename || precomputeCancelled) return;
+  precomputeCancelled = true;
+  fetch(api('/precompute/cancel'), {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: currentFilename })
+  }).catch(()=>{});
+}
+
 function processImage() {
   if (!currentFilename) return;
   hideError();
@@ -261,6 +276,7 @@ function displayProcessedInfo(data) {
     <table class="table table-sm">
       <tr><td><strong>Format:</strong></td><td>${info.format}</td></tr>
       <tr><td><strong>Dimensions:</strong></td><td>${info.width} × ${info.height}px</td></tr>
+      ${info.frames ? `<tr><td><strong>Frames:</strong></td><td>${info.frames}</td></tr>` : ''}
       <tr><td><strong>Aspect Ratio:</strong></td><td>${info.aspect_ratio} (${cropOrientation})</td></tr>
       <tr><td><strong>Color Profile:</strong></td><td>${colorProfileBadge}</td></tr>
       <tr><td><strong>File Size:</strong></td><td>${info.file_size_human}</td></tr>
@@ -0,0 +1,36 @@
+"""
+Configuration gunicorn de production, passée explicitement avec
+`gunicorn -c gunicorn_config.py` (Dockerfile, bench). Le nom n'est pas
+gunicorn.conf.py pour que gunicorn ne la charge pas d'office : le workflow de
+développement (`gunicorn --reload main:app`) garde un seul worker sans preload.
+
+- preload_app : l'app (Flask, Pillow, routes) est importée une seule fois
+  dans le master puis partagée par fork avec les workers.
+- when_ready : amorce les codecs image / HEIF / lcms2 avant le fork, pour que
+  la première requête /api/process d'un worker ne paie pas ce coût.
+"""
+import os
+import sys
+
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+# --reload recharge le code dans les workers : incompatible avec le preload
+reload = "--reload" in sys.argv or os.environ.get("GUNICORN_RELOAD", "0") == "1"
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1" and not reload
+
+# Plusieurs workers : le registre des fichiers doit être partagé (SQLite)
+if workers > 1:
+    os.environ.setdefault("ARTIFACT_DB", "/tmp/artifacts.sqlite3")
+
+WARMUP_ON_START = os.environ.get("WARMUP_ON_START", "1") == "1"
+
+
+def when_ready(server):
+    if not WARMUP_ON_START:
+        return
+    try:
+        from utils.image_processor import warmup
+        warmup()
+    except Exception as e:
+        server.log.warning(f"Warm-up skipped: {e}")
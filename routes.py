@@ -1,14 +1,24 @@
 import os
+import math
+import time
 import uuid
 import logging
 from flask import Blueprint, render_template, request, jsonify, send_file, current_app, after_this_request
 from werkzeug.utils import secure_filename
-from utils.image_processor import ImageProcessor, get_image_info
-from PIL import Image
-from pillow_heif import register_heif_opener
+from utils.image_processor import (
+    MAX_BYTES_FLOOR,
+    MIN_OUTPUT_EDGE,
+    get_image_info,
+    human_file_size,
+    open_image,
+    probe_bit_depth,
+    select_processor,
+)
+from utils.sequence_processor import SEQUENCE_EXTENSIONS, SEQUENCE_OUTPUTS, SequenceProcessor, default_sequence_output
+from utils.artifact_registry import KIND_UPLOAD, KIND_PREVIEW, KIND_OUTPUT, KIND_PRECOMPUTED
+from utils.precompute import merge_stats
 
 logger = logging.getLogger(__name__)
-register_heif_opener()  # Enable HEIC/HEIF support in Pillow
 
 # Blueprint (évite l'import circulaire avec app)
 bp = Blueprint("main", __name__)
@@ -23,19 +33,291 @@ MIME_TYPES = {
     "tif": "image/tiff",
     "tiff": "image/tiff",
     "webp": "image/webp",
+    "zip": "application/zip",
 }
 
+PROCESSED_SUFFIXES = [
+    "_cropped_2x3", "_cropped_3x2", "_precomputed_2x3", "_precomputed_3x2",
+    "_cropped_2x3_frames", "_cropped_3x2_frames",
+]
+PROCESSED_EXTENSIONS = [".jpg", ".jpeg", ".png", ".tif", ".tiff", ".webp", ".zip"]
+SIXTEEN_BIT_MODES = ["I;16", "I;16L", "I;16B"]
+
+# Réglages par défaut du front : crops précalculés juste après l'upload
+DEFAULT_FOCUS_X, DEFAULT_FOCUS_Y, DEFAULT_ZOOM = 0.5, 0.5, 1.0
+PRECOMPUTE_ORIENTATIONS = ["portrait", "landscape"]
+# Borne de l'attente d'un précalcul démarré ; l'attente réelle suit le coût
+# estimé d'un crop direct (voir Precomputer.claim)
+PRECOMPUTE_CLAIM_TIMEOUT = float(os.environ.get("PRECOMPUTE_CLAIM_TIMEOUT", "30"))
+
+def parse_print_size(value):
+    """'10x15' (cm), [10, 15] ou None -> (10.0, 15.0) / None ; ValueError sinon"""
+    if value in (None, ""):
+        return None
+    if isinstance(value, str):
+        parts = value.lower().replace("cm", "").replace(" ", "").split("x")
+    else:
+        parts = list(value)
+    if len(parts) != 2:
+        raise ValueError("print_size must look like '10x15' (cm)")
+    width_cm, height_cm = (float(p) for p in parts)
+    if not (math.isfinite(width_cm) and math.isfinite(height_cm)):
+        raise ValueError("print_size must be finite")
+    if width_cm <= 0 or height_cm <= 0:
+        raise ValueError("print_size must be positive")
+    return (width_cm, height_cm)
+
+def parse_positive(value, cast, name: str, minimum=None, maximum=None):
+    """Nombre fini > 0 dans [minimum, maximum] ; cast=int refuse les décimales (1.5)"""
+    if value in (None, ""):
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a number")
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be finite")
+    if cast is int:
+        if not number.is_integer():
+            raise ValueError(f"{name} must be an integer")
+        number = int(number)
+    if number <= 0 or (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise ValueError(f"{name} out of range")
+    return number
+
+def parse_bool(value, name: str) -> bool:
+    """Booléen JSON, ou "true"/"false"/"1"/"0" ; ValueError sinon"""
+    if value in (None, ""):
+        return False
+    if isinstance(value, bool):
+        return value
+    normalized = str(value).strip().lower()
+    if normalized in ("true", "1"):
+        return True
+    if normalized in ("false", "0"):
+        return False
+    raise ValueError(f"{name} must be a boolean")
+
 def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def is_valid_image_format(filepath: str) -> bool:
     try:
-        with Image.open(filepath) as img:
+        with open_image(filepath) as img:
             img.verify()
         return True
     except Exception:
         return False
 
+# ────────────────────────────────────────────────────────────────────────────────
+# Registre des fichiers
+# ────────────────────────────────────────────────────────────────────────────────
+
+def _registry():
+    return current_app.extensions["artifact_registry"]
+
+def _upload_meta(image_info: dict) -> dict:
+    return {k: image_info.get(k) for k in ("format", "mode", "bit_depth", "width", "height", "frames")}
+
+def _lookup_upload(filename: str):
+    """
+    Enregistrement de l'upload dans le registre. S'il est inconnu (upload reçu
+    par un autre worker avec un registre en mémoire), on l'adopte depuis le disque.
+    Si le fichier a disparu (nettoyage externe, redéploiement), l'upload et ses
+    dérivés sont retirés du registre et None est renvoyé.
+    """
+    registry = _registry()
+    record = registry.get(filename, KIND_UPLOAD)
+    if record is not None:
+        if os.path.exists(record["path"]):
+            return record
+        _precomputer().cancel(filename)
+        for path in released_paths(registry.pop_upload(filename) or [], _precomputer()):
+            _remove_quietly(path)
+        return None
+
+    path = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
+    if not os.path.exists(path):
+        return None
+    with open_image(path) as img:
+        meta = {
+            "format": img.format, "mode": img.mode, "bit_depth": probe_bit_depth(img),
+            "width": img.width, "height": img.height,
+        }
+    registry.register_upload(filename, path, meta)
+    return registry.get(filename, KIND_UPLOAD)
+
+def _lookup_path(filename: str, kinds, folder: str):
+    """Chemin d'un fichier connu du registre, sinon sondage du disque (une seule fois)"""
+    record = _registry().get(filename)
+    if record is not None and record["kind"] in kinds:
+        return record["path"]
+    path = os.path.join(folder, filename)
+    return path if os.path.exists(path) else None
+
+def _probe_derived_paths(filename: str) -> list:
+    """Ancien sondage exhaustif, pour les uploads absents du registre"""
+    upload_dir = current_app.config["UPLOAD_FOLDER"]
+    processed_dir = current_app.config["PROCESSED_FOLDER"]
+    base_name, _ = os.path.splitext(filename)
+
+    candidates = [
+        os.path.join(upload_dir, filename),
+        os.path.join(upload_dir, f"{base_name}_preview.jpg"),
+    ]
+    for suffix in PROCESSED_SUFFIXES:
+        for ext in PROCESSED_EXTENSIONS:
+            candidates.append(os.path.join(processed_dir, f"{base_name}{suffix}{ext}"))
+    return [p for p in candidates if os.path.exists(p)]
+
+# ────────────────────────────────────────────────────────────────────────────────
+# Plan de sortie / précalcul
+# ────────────────────────────────────────────────────────────────────────────────
+
+def _output_plan(filename: str, meta: dict, orientation: str):
+    """Moteur, suffixe de crop et extension de sortie pour un upload"""
+    _, extension = os.path.splitext(filename)
+    crop_suffix = "2x3" if orientation == "portrait" else "3x2"
+
+    # moteur choisi d'après les métadonnées (NumPy 16 bits ou Pillow)
+    processor = select_processor(meta)
+    high_bit = processor.preserves_high_bit_depth
+
+    # extension de sortie (préserver TIFF 16-bit, sinon JPEG pour tif/heic/heif)
+    output_ext = extension
+    is_16bit_tiff = high_bit or (meta.get("format") == "TIFF" and meta.get("mode") in SIXTEEN_BIT_MODES)
+    if not is_16bit_tiff and extension.lower() in [".tif", ".tiff", ".heic", ".heif"]:
+        output_ext = ".jpg"
+    return processor, crop_suffix, output_ext
+
+def _sequence_info(output_path: str, output_filename: str, summary: dict, output: str) -> dict:
+    """Infos de sortie d'une séquence (TIFF multi-pages ou ZIP de frames)"""
+    if output == "tiff":
+        info = get_image_info(output_path)
+    else:
+        width, height = summary["frame_sizes"][0]
+        file_size = os.path.getsize(output_path)
+        info = {
+            "filename": output_filename,
+            "format": "ZIP",
+            "width": width,
+            "height": height,
+            "size": f"{width} x {height}",
+            "aspect_ratio": round(width / height, 3) if height else None,
+            "file_size": file_size,
+            "file_size_human": human_file_size(file_size),
+        }
+    info["frames"] = summary["frames"]
+    info["sequence_output"] = output
+    return info
+
+def _precomputer():
+    return current_app.extensions["precomputer"]
+
+def _precomputed_filename(filename: str, crop_suffix: str, output_ext: str) -> str:
+    base_name, _ = os.path.splitext(filename)
+    return f"{base_name}_precomputed_{crop_suffix}{output_ext}"
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _precompute_job(registry, filename: str, input_path: str, processor, orientation: str, name: str, path: str):
+    """Job de précalcul + fonction d'abandon (exécutés hors contexte Flask)"""
+    def job(cancelled):
+        start = time.thread_time()
+        # cancelled est vérifié entre décodage et encodage par crop_image
+        if not processor.crop_image(input_path, path, orientation=orientation, cancelled=cancelled):
+            return None
+        if cancelled.is_set():
+            _remove_quietly(path)
+            return None
+        # CPU dans le registre : un autre worker peut réclamer ou jeter ce résultat
+        meta = {"orientation": orientation, "cpu_seconds": time.thread_time() - start}
+        registry.add_artifact(filename, KIND_PRECOMPUTED, name, path, meta)
+        return {"filename": name, "path": path}
+
+    def discard(result):
+        registry.forget(result["filename"])
+        _remove_quietly(result["path"])
+
+    return job, discard
+
+def released_paths(records, precomputer) -> list:
+    """
+    Chemins des enregistrements retirés du registre (cleanup, GC). Les crops
+    précalculés jamais réclamés, quel que soit le worker qui les a calculés,
+    sont comptés comme CPU gaspillé.
+    """
+    for record in records:
+        if record["kind"] == KIND_PRECOMPUTED:
+            precomputer.record_discarded(record["meta"].get("cpu_seconds", 0.0))
+    return [record["path"] for record in records]
+
+def collect_precompute_stats(registry, precomputer) -> dict:
+    """
+    Stats de précalcul sommées sur tous les workers (publiées dans le registre),
+    avec le détail par pid ; celles du worker qui répond sont prises en direct.
+    """
+    per_worker = registry.worker_stats()
+    per_worker[os.getpid()] = precomputer.stats()
+    stats = merge_stats(per_worker)
+    stats["pid"] = os.getpid()
+    stats["enabled"] = precomputer.enabled
+    return stats
+
+def _discard_precomputed(filename: str) -> int:
+    """
+    Annule les précalculs d'un upload : jobs de ce process, et résultats déjà
+    enregistrés par les autres workers (registre partagé).
+    """
+    precomputer = _precomputer()
+    registry = _registry()
+    count = precomputer.cancel(filename)
+    for record in registry.derived(filename, KIND_PRECOMPUTED):
+        registry.forget(record["filename"])
+        _remove_quietly(record["path"])
+        precomputer.record_discarded(record["meta"].get("cpu_seconds", 0.0))
+        count += 1
+    return count
+
+def _schedule_default_crops(filename: str, input_path: str, meta: dict) -> None:
+    registry = _registry()
+    precomputer = _precomputer()
+    processed_dir = current_app.config["PROCESSED_FOLDER"]
+    width, height = meta.get("width"), meta.get("height")
+    megapixels = width * height / 1e6 if width and height else None
+    for orientation in PRECOMPUTE_ORIENTATIONS:
+        processor, crop_suffix, output_ext = _output_plan(filename, meta, orientation)
+        name = _precomputed_filename(filename, crop_suffix, output_ext)
+        job, discard = _precompute_job(
+            registry, filename, input_path, processor, orientation, name, os.path.join(processed_dir, name)
+        )
+        if not precomputer.schedule((filename, orientation), job, discard, megapixels=megapixels):
+            logger.info(f"Precompute skipped for {filename} ({orientation}): disabled or under load")
+
+def _claim_precomputed(filename: str, orientation: str, crop_suffix: str, output_ext: str, output_path: str) -> bool:
+    """
+    Déplace le crop précalculé vers output_path. Le résultat peut venir de ce
+    process (claim) ou d'un autre worker (registre partagé).
+    """
+    result = _precomputer().claim((filename, orientation), timeout=PRECOMPUTE_CLAIM_TIMEOUT)
+    name = result["filename"] if result else _precomputed_filename(filename, crop_suffix, output_ext)
+    registry = _registry()
+    record = registry.get(name, KIND_PRECOMPUTED)
+    if record is None:
+        return False
+    registry.forget(name)
+    try:
+        os.replace(record["path"], output_path)
+    except OSError:
+        return False
+    if result is None:
+        # calculé par un autre worker
+        _precomputer().record_claimed(record["meta"].get("cpu_seconds", 0.0))
+    return True
+
 # ────────────────────────────────────────────────────────────────────────────────
 # Health / Ping / Home
 # ────────────────────────────────────────────────────────────────────────────────
@@ -96,7 +378,7 @@ def upload_file():
 
         if ext in {"heic", "heif"}:
             logger.info("Detected HEIC/HEIF format, creating JPEG preview...")
-            image = Image.open(filepath).convert("RGB")
+            image = open_image(filepath).convert("RGB")
             preview_filename = filename.rsplit(".", 1)[0] + "_preview.jpg"
             preview_filepath = os.path.join(upload_dir, preview_filename)
             image.save(preview_filepath, format="JPEG", quality=95)
@@ -115,6 +397,14 @@ def upload_file():
         image_info = get_image_info(filepath)
         logger.info(f"Image info: {image_info}")
 
+        registry = _registry()
+        registry.register_upload(filename, filepath, _upload_meta(image_info))
+        if preview_filename != filename:
+            registry.add_artifact(filename, KIND_PREVIEW, preview_filename, preview_filepath)
+
+        # Crops par défaut calculés en tâche de fond (priorité basse, throttlés)
+        _schedule_default_crops(filename, filepath, _upload_meta(image_info))
+
         return jsonify({
             "success": True,
             "filename": filename,
@@ -133,9 +423,8 @@ def upload_file():
 @bp.route("/preview/<filename>")
 def preview_image(filename):
     try:
-        filepath = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
-
-        if not os.path.exists(filepath):
+        filepath = _lookup_path(filename, (KIND_UPLOAD, KIND_PREVIEW), current_app.config["UPLOAD_FOLDER"])
+        if filepath is None:
             return jsonify({"error": "File not found"}), 404
 
         if filename.endswith("_preview.jpg"):
@@ -145,6 +434,9 @@ def preview_image(filename):
         mimetype = MIME_TYPES.get(ext, "image/jpeg")
         return send_file(filepath, mimetype=mimetype)
 
+    except FileNotFoundError:
+        _registry().forget(filename)
+        return jsonify({"error": "File not found"}), 404
     except Exception as e:
         logger.error(f"Preview error: {str(e)}", exc_info=True)
         return jsonify({"error": "Preview failed"}), 500
@@ -166,45 +458,129 @@ def process_image():
         if not filename:
             return jsonify({"error": "No filename provided"}), 400
 
-        input_path = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
-        if not os.path.exists(input_path):
-            return jsonify({"error": "Input file not found"}), 404
+        try:
+            sequence = parse_bool(data.get("sequence"), "sequence")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        base_name, extension = os.path.splitext(filename)
-        crop_suffix = "2x3" if orientation == "portrait" else "3x2"
+        # Sortie à la taille d'impression (cm + DPI) ou bornée en pixels
+        try:
+            print_size = parse_print_size(data.get("print_size"))
+            dpi = parse_positive(data.get("dpi"), float, "dpi", maximum=4800)
+            max_edge = parse_positive(data.get("max_edge"), int, "max_edge", minimum=MIN_OUTPUT_EDGE)
+            max_bytes = parse_positive(data.get("max_bytes"), int, "max_bytes", minimum=MAX_BYTES_FLOOR)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid output size: {e}"}), 400
+
+        upload = _lookup_upload(filename)
+        if upload is None:
+            return jsonify({"error": "Input file not found"}), 404
+        input_path = upload["path"]
+        meta = upload["meta"]
+
+        base_name, _ = os.path.splitext(filename)
+        processor, crop_suffix, output_ext = _output_plan(filename, meta, orientation)
+
+        # Séquence : toutes les frames (TIFF multi-pages, rafales HEIF)
+        sequence_output = None
+        if sequence:
+            sequence_output = data.get("sequence_output") or default_sequence_output(meta.get("format"))
+            if sequence_output not in SEQUENCE_OUTPUTS:
+                return jsonify({"error": "sequence_output must be 'tiff' or 'zip'"}), 400
+            if max_bytes:
+                return jsonify({"error": "max_bytes does not apply to sequence output"}), 400
+            # moteur NumPy 16 bits : TIFF uniquement (lecture page par page via tifffile)
+            processor = SequenceProcessor(
+                high_bit=processor.preserves_high_bit_depth and meta.get("format") == "TIFF"
+            )
+            output_ext = SEQUENCE_EXTENSIONS[sequence_output]
+            crop_suffix = f"{crop_suffix}_frames"
 
-        # extension de sortie (préserver TIFF 16-bit, sinon JPEG pour tif/heic/heif)
-        output_ext = extension
-        with Image.open(input_path) as img:
-            is_16bit_tiff = img.format == "TIFF" and img.mode in ["I;16", "I;16L", "I;16B"]
-            if not is_16bit_tiff and extension.lower() in [".tif", ".tiff", ".heic", ".heif"]:
-                output_ext = ".jpg"
+        # Taille maximale : seulement pour les sorties JPEG / WebP
+        if max_bytes and output_ext.lower() not in [".jpg", ".jpeg", ".webp"]:
+            return jsonify({"error": "max_bytes only applies to JPEG and WebP output"}), 400
 
         output_filename = f"{base_name}_cropped_{crop_suffix}{output_ext}"
         output_path = os.path.join(current_app.config["PROCESSED_FOLDER"], output_filename)
 
-        logger.info(f"Processing: {input_path} -> {output_path}")
-        processor = ImageProcessor()
+        # Réglages par défaut : résultat précalculé après l'upload si disponible
+        is_default = (
+            (focus_x, focus_y, zoom) == (DEFAULT_FOCUS_X, DEFAULT_FOCUS_Y, DEFAULT_ZOOM)
+            and orientation in PRECOMPUTE_ORIENTATIONS
+            and not any((print_size, dpi, max_edge, max_bytes, sequence))
+        )
+        precomputed = False
+        if is_default:
+            precomputed = _claim_precomputed(filename, orientation, crop_suffix, output_ext, output_path)
+            _precomputer().record_lookup(precomputed)
+        else:
+            # réglages modifiés : les crops par défaut ne serviront pas
+            _discard_precomputed(filename)
+
+        logger.info(
+            f"Processing: {input_path} -> {output_path} "
+            f"({'precomputed' if precomputed else type(processor).__name__})"
+        )
 
         try:
-            success = processor.crop_image(
-                input_path,
-                output_path,
-                focus_x=focus_x,
-                focus_y=focus_y,
-                zoom=zoom,
-                orientation=orientation,
-            )
-
-            if not success:
-                logger.error("Image processing returned failure")
-                return jsonify({"error": "Image processing failed"}), 500
+            if sequence:
+                success = processor.crop_sequence(
+                    input_path,
+                    output_path,
+                    focus_x=focus_x,
+                    focus_y=focus_y,
+                    zoom=zoom,
+                    orientation=orientation,
+                    output=sequence_output,
+                    print_size=print_size,
+                    dpi=dpi,
+                    max_edge=max_edge,
+                )
+
+                if not success:
+                    logger.error("Sequence processing returned failure")
+                    return jsonify({"error": "Image processing failed"}), 500
+            elif not precomputed:
+                success = processor.crop_image(
+                    input_path,
+                    output_path,
+                    focus_x=focus_x,
+                    focus_y=focus_y,
+                    zoom=zoom,
+                    orientation=orientation,
+                    print_size=print_size,
+                    dpi=dpi,
+                    max_edge=max_edge,
+                    max_bytes=max_bytes,
+                )
+
+                if not success:
+                    logger.error("Image processing returned failure")
+                    return jsonify({"error": "Image processing failed"}), 500
+
+                encode = processor.last_encode
+                if max_bytes and encode and not encode["max_bytes_met"]:
+                    # même à la qualité minimale le fichier dépasse : on ne livre pas
+                    _remove_quietly(output_path)
+                    return jsonify({
+                        "error": "max_bytes unreachable at minimum quality",
+                        "max_bytes": max_bytes,
+                        "min_bytes": encode["bytes"],
+                        "min_bytes_human": human_file_size(encode["bytes"]),
+                    }), 422
 
             if not os.path.exists(output_path):
                 logger.error("Output file was not created")
                 return jsonify({"error": "Processing failed - output file not created"}), 500
 
-            processed_info = get_image_info(output_path)
+            if sequence:
+                processed_info = _sequence_info(output_path, output_filename, processor.last_summary, sequence_output)
+            else:
+                processed_info = get_image_info(output_path)
+            processed_info["precomputed"] = precomputed
+            if not sequence and processor.last_encode and not precomputed:
+                processed_info["encode"] = processor.last_encode
+            _registry().add_artifact(filename, KIND_OUTPUT, output_filename, output_path)
 
         except Exception as proc_error:
             logger.error(f"Processing exception: {str(proc_error)}", exc_info=True)
@@ -227,8 +603,8 @@ def process_image():
 @bp.route("/download/<filename>")
 def download_file(filename):
     try:
-        filepath = os.path.join(current_app.config["PROCESSED_FOLDER"], filename)
-        if not os.path.exists(filepath):
+        filepath = _lookup_path(filename, (KIND_OUTPUT,), current_app.config["PROCESSED_FOLDER"])
+        if filepath is None:
             return jsonify({"error": "File not found"}), 404
 
         @after_this_request
@@ -237,6 +613,7 @@ def download_file(filename):
                 os.remove(filepath)
             except Exception:
                 pass
+            _registry().forget(filename)
             return resp
 
         ext = filename.rsplit(".", 1)[-1].lower()
@@ -248,6 +625,9 @@ def download_file(filename):
             download_name=filename,
             mimetype=mimetype,
         )
+    except FileNotFoundError:
+        _registry().forget(filename)
+        return jsonify({"error": "File not found"}), 404
     except Exception as e:
         logger.error(f"Download error: {str(e)}", exc_info=True)
         return jsonify({"error": "Download failed"}), 500
@@ -263,34 +643,48 @@ def cleanup_files():
         filenames = data.get("filenames", [])
 
         cleaned_count = 0
-        upload_dir = current_app.config["UPLOAD_FOLDER"]
-        processed_dir = current_app.config["PROCESSED_FOLDER"]
+        registry = _registry()
 
         for filename in filenames:
-            # fichier uploadé
-            upload_path = os.path.join(upload_dir, filename)
-            if os.path.exists(upload_path):
-                os.remove(upload_path)
-                cleaned_count += 1
-
-            # preview éventuel
-            base_name, _ = os.path.splitext(filename)
-            preview_path = os.path.join(upload_dir, f"{base_name}_preview.jpg")
-            if os.path.exists(preview_path):
-                os.remove(preview_path)
-                cleaned_count += 1
-
-            # fichiers traités (toutes les orientations/formats usuels)
-            for suffix in ["_cropped_2x3", "_cropped_3x2"]:
-                for ext in [".jpg", ".jpeg", ".png", ".tif", ".tiff", ".webp"]:
-                    processed_filename = f"{base_name}{suffix}{ext}"
-                    processed_path = os.path.join(processed_dir, processed_filename)
-                    if os.path.exists(processed_path):
-                        os.remove(processed_path)
-                        cleaned_count += 1
+            # précalculs en file ou en cours : abandonnés (leur résultat sera jeté)
+            _precomputer().cancel(filename)
+
+            # upload + preview + fichiers traités connus du registre
+            records = registry.pop_upload(filename)
+            if records is None:
+                paths = _probe_derived_paths(filename)
+            else:
+                paths = released_paths(records, _precomputer())
+
+            for path in paths:
+                try:
+                    os.remove(path)
+                    cleaned_count += 1
+                except FileNotFoundError:
+                    pass
 
         return jsonify({"success": True, "cleaned_files": cleaned_count})
 
     except Exception as e:
         logger.error(f"Cleanup error: {str(e)}", exc_info=True)
         return jsonify({"error": "Cleanup failed"}), 500
+
+# ────────────────────────────────────────────────────────────────────────────────
+# Précalcul : annulation (réglages modifiés côté front) et statistiques
+# ────────────────────────────────────────────────────────────────────────────────
+
+@bp.route("/precompute/cancel", methods=["POST"])
+def cancel_precompute():
+    try:
+        data = request.get_json(force=True, silent=False)
+        filename = data.get("filename")
+        if not filename:
+            return jsonify({"error": "No filename provided"}), 400
+        return jsonify({"success": True, "cancelled": _discard_precomputed(filename)})
+    except Exception as e:
+        logger.error(f"Precompute cancel error: {str(e)}", exc_info=True)
+        return jsonify({"error": "Cancel failed"}), 500
+
+@bp.route("/precompute/stats")
+def precompute_stats():
+    return jsonify(collect_precompute_stats(_registry(), _precomputer()))
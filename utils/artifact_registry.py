@@ -0,0 +1,259 @@
+"""
+Registre des fichiers éphémères (uploads, previews, sorties traitées).
+
+Chaque upload est enregistré avec ses métadonnées au moment de sa création,
+ainsi que les fichiers qui en dérivent. Les routes process / cleanup /
+download / preview et le GC font ainsi des recherches dans un index au lieu
+de sonder le système de fichiers.
+
+Le registre sert aussi de point de rendez-vous pour les statistiques des
+workers (précalcul) : chacun publie les siennes, la lecture les rassemble.
+
+Deux implémentations :
+  - ArtifactRegistry : en mémoire, propre à un process ;
+  - SQLiteArtifactRegistry : partagée entre les workers gunicorn via un
+    fichier SQLite (activée par la variable ARTIFACT_DB).
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+KIND_UPLOAD = "upload"
+KIND_PREVIEW = "preview"
+KIND_OUTPUT = "output"
+KIND_PRECOMPUTED = "precomputed"
+
+
+class ArtifactRegistry:
+    """Registre en mémoire, thread-safe, local au process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # filename -> {"path", "kind", "upload", "meta", "created"}
+        self._artifacts = {}
+        # upload filename -> set(filenames dérivés)
+        self._derived = {}
+        # pid -> dernières stats publiées par ce worker
+        self._worker_stats = {}
+
+    def register_upload(self, filename, path, meta=None):
+        with self._lock:
+            self._artifacts[filename] = {
+                "filename": filename,
+                "path": path,
+                "kind": KIND_UPLOAD,
+                "upload": filename,
+                "meta": dict(meta or {}),
+                "created": time.time(),
+            }
+            self._derived.setdefault(filename, set())
+
+    def add_artifact(self, upload, kind, filename, path, meta=None):
+        with self._lock:
+            self._artifacts[filename] = {
+                "filename": filename,
+                "path": path,
+                "kind": kind,
+                "upload": upload,
+                "meta": dict(meta or {}),
+                "created": time.time(),
+            }
+            self._derived.setdefault(upload, set()).add(filename)
+
+    def get(self, filename, kind=None):
+        with self._lock:
+            record = self._artifacts.get(filename)
+        if record is None or (kind is not None and record["kind"] != kind):
+            return None
+        return record
+
+    def derived(self, upload, kind=None):
+        with self._lock:
+            names = list(self._derived.get(upload, ()))
+            records = [self._artifacts[n] for n in names if n in self._artifacts]
+        return [r for r in records if kind is None or r["kind"] == kind]
+
+    def forget(self, filename):
+        with self._lock:
+            self._forget_locked(filename)
+
+    def _forget_locked(self, filename):
+        record = self._artifacts.pop(filename, None)
+        if record is None:
+            return None
+        if record["kind"] == KIND_UPLOAD:
+            self._derived.pop(filename, None)
+        else:
+            self._derived.get(record["upload"], set()).discard(filename)
+        return record
+
+    def pop_upload(self, upload):
+        """
+        Retire un upload et tous ses dérivés du registre.
+        Renvoie les enregistrements retirés, ou None si l'upload est inconnu.
+        """
+        with self._lock:
+            if upload not in self._artifacts and upload not in self._derived:
+                return None
+            records = []
+            for name in list(self._derived.get(upload, ())):
+                record = self._forget_locked(name)
+                if record:
+                    records.append(record)
+            record = self._forget_locked(upload)
+            if record:
+                records.append(record)
+            self._derived.pop(upload, None)
+            return records
+
+    def expire(self, ttl_seconds):
+        """Retire les entrées plus vieilles que ttl_seconds et renvoie les enregistrements retirés"""
+        cutoff = time.time() - ttl_seconds
+        with self._lock:
+            expired = [n for n, r in self._artifacts.items() if r["created"] < cutoff]
+            return [r for r in (self._forget_locked(n) for n in expired) if r]
+
+    def publish_worker_stats(self, pid, stats):
+        with self._lock:
+            self._worker_stats[pid] = dict(stats)
+
+    def worker_stats(self):
+        """Dernières stats publiées par chaque worker : {pid: stats}"""
+        with self._lock:
+            return {pid: dict(stats) for pid, stats in self._worker_stats.items()}
+
+
+class SQLiteArtifactRegistry(ArtifactRegistry):
+    """Registre partagé entre process via SQLite (une connexion par thread et par pid)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS artifacts (
+            filename TEXT PRIMARY KEY,
+            path     TEXT NOT NULL,
+            kind     TEXT NOT NULL,
+            upload   TEXT NOT NULL,
+            meta     TEXT NOT NULL DEFAULT '{}',
+            created  REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_artifacts_upload ON artifacts(upload);
+        CREATE INDEX IF NOT EXISTS idx_artifacts_created ON artifacts(created);
+        CREATE TABLE IF NOT EXISTS worker_stats (
+            pid     INTEGER PRIMARY KEY,
+            stats   TEXT NOT NULL,
+            updated REAL NOT NULL
+        );
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        # Les connexions ne doivent pas traverser un fork (preload gunicorn)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        record = dict(row)
+        record["meta"] = json.loads(record["meta"] or "{}")
+        return record
+
+    def _insert(self, filename, path, kind, upload, meta):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO artifacts(filename, path, kind, upload, meta, created)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (filename, path, kind, upload, json.dumps(meta or {}), time.time()),
+        )
+
+    def register_upload(self, filename, path, meta=None):
+        self._insert(filename, path, KIND_UPLOAD, filename, meta)
+
+    def add_artifact(self, upload, kind, filename, path, meta=None):
+        self._insert(filename, path, kind, upload, meta)
+
+    def get(self, filename, kind=None):
+        row = self._connect().execute(
+            "SELECT * FROM artifacts WHERE filename = ?", (filename,)
+        ).fetchone()
+        record = self._row(row)
+        if record is None or (kind is not None and record["kind"] != kind):
+            return None
+        return record
+
+    def derived(self, upload, kind=None):
+        rows = self._connect().execute(
+            "SELECT * FROM artifacts WHERE upload = ? AND kind != ?", (upload, KIND_UPLOAD)
+        ).fetchall()
+        records = [self._row(r) for r in rows]
+        return [r for r in records if kind is None or r["kind"] == kind]
+
+    def forget(self, filename):
+        self._connect().execute("DELETE FROM artifacts WHERE filename = ?", (filename,))
+
+    def pop_upload(self, upload):
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT * FROM artifacts WHERE upload = ? OR filename = ?", (upload, upload)
+            ).fetchall()
+            if not rows:
+                return None
+            conn.execute("DELETE FROM artifacts WHERE upload = ? OR filename = ?", (upload, upload))
+        return [self._row(r) for r in rows]
+
+    def expire(self, ttl_seconds):
+        cutoff = time.time() - ttl_seconds
+        conn = self._connect()
+        # Appelé à chaque requête : simple lecture indexée (sans verrou en WAL),
+        # le verrou d'écriture n'est pris que s'il y a des entrées expirées
+        if conn.execute("SELECT 1 FROM artifacts WHERE created < ? LIMIT 1", (cutoff,)).fetchone() is None:
+            return []
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT * FROM artifacts WHERE created < ?", (cutoff,)
+            ).fetchall()
+            if rows:
+                conn.execute("DELETE FROM artifacts WHERE created < ?", (cutoff,))
+        return [self._row(r) for r in rows]
+
+    def publish_worker_stats(self, pid, stats):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO worker_stats(pid, stats, updated) VALUES (?, ?, ?)",
+            (pid, json.dumps(stats), time.time()),
+        )
+
+    def worker_stats(self):
+        rows = self._connect().execute("SELECT pid, stats FROM worker_stats").fetchall()
+        return {row["pid"]: json.loads(row["stats"]) for row in rows}
+
+
+def create_registry(db_path=None):
+    """Registre SQLite si db_path est fourni, sinon registre en mémoire"""
+    if db_path:
+        try:
+            registry = SQLiteArtifactRegistry(db_path)
+            logger.info(f"Artifact registry: SQLite ({db_path})")
+            return registry
+        except Exception as e:
+            logger.warning(f"SQLite artifact registry unavailable ({e}), falling back to memory")
+    logger.info("Artifact registry: in-memory")
+    return ArtifactRegistry()
@@ -0,0 +1,298 @@
+"""
+Moteur de crop haute profondeur (16 bits par canal) basé sur NumPy.
+
+Pillow ramène les TIFF RGB 16 bits et les PNG 16 bits à 8 bits dès
+l'ouverture. Ici les pixels sont décodés en tableaux uint16 (tifffile pour le
+TIFF, imagecodecs pour le PNG), l'orientation EXIF et le crop sont de simples
+vues NumPy (aucune copie), puis le résultat est réécrit en TIFF / PNG 16 bits.
+
+Dépendances optionnelles : numpy, tifffile, imagecodecs. Sans elles,
+select_processor() retombe sur le moteur Pillow.
+"""
+import os
+import struct
+import zlib
+import logging
+
+from utils.image_processor import (
+    REDUCING_GAP,
+    ImageProcessor,
+    compute_crop_box,
+    compute_output_size,
+    open_image,
+)
+
+logger = logging.getLogger(__name__)
+
+HIGH_BIT_FORMATS = ('TIFF', 'PNG')
+
+_available = None
+
+
+def is_available():
+    """True si numpy, tifffile et imagecodecs sont importables"""
+    global _available
+    if _available is None:
+        try:
+            import numpy  # noqa: F401
+            import tifffile  # noqa: F401
+            import imagecodecs  # noqa: F401
+            _available = True
+        except ImportError:
+            _available = False
+    return _available
+
+
+def wants_high_bit_engine(meta):
+    """La source est un TIFF ou PNG 16 bits (d'après le probe de l'upload)"""
+    return (meta or {}).get('format') in HIGH_BIT_FORMATS and (meta or {}).get('bit_depth') == 16
+
+
+# ── Orientation EXIF par vues NumPy ───────────────────────────────────────────
+# Même mapping que ImageProcessor._apply_exif_orientation
+# (Image.ROTATE_90 = rotation anti-horaire = np.rot90(a, 1))
+def _flip_lr(a):
+    return a[:, ::-1]
+
+
+def _flip_tb(a):
+    return a[::-1]
+
+
+def _rot90(a):
+    return a.swapaxes(0, 1)[::-1]
+
+
+def _rot180(a):
+    return a[::-1, ::-1]
+
+
+def _rot270(a):
+    return a.swapaxes(0, 1)[:, ::-1]
+
+
+ORIENTATION_VIEWS = {
+    2: [_flip_lr],
+    3: [_rot180],
+    4: [_flip_tb],
+    5: [_flip_lr, _rot90],
+    6: [_rot270],
+    7: [_flip_lr, _rot270],
+    8: [_rot90],
+}
+
+
+def apply_orientation(arr, orientation):
+    """Applique l'orientation EXIF sans copier les pixels"""
+    for view in ORIENTATION_VIEWS.get(orientation, ()):
+        arr = view(arr)
+    return arr
+
+
+def crop_array(arr, box):
+    """Crop par slicing (vue), boîte bornée aux dimensions du tableau"""
+    h, w = arr.shape[:2]
+    left, top, right, bottom = box
+    left, top = max(0, left), max(0, top)
+    right, bottom = min(w, right), min(h, bottom)
+    return arr[top:bottom, left:right]
+
+
+def downscale_array(arr, size):
+    """
+    Réduction 16 bits canal par canal via des images Pillow 'F' (float32) :
+    reduce() entier puis passe Lanczos finale, un seul canal flottant en mémoire.
+    """
+    import numpy as np
+    from PIL import Image
+
+    h, w = arr.shape[:2]
+    factor = int(min(w / size[0], h / size[1]) / REDUCING_GAP)
+    limit = np.iinfo(arr.dtype).max if arr.dtype.kind in 'ui' else None
+
+    planes = arr[..., None] if arr.ndim == 2 else arr
+    out = np.empty((size[1], size[0], planes.shape[2]), dtype=arr.dtype)
+    for c in range(planes.shape[2]):
+        channel = Image.fromarray(np.ascontiguousarray(planes[..., c], dtype=np.float32), 'F')
+        if factor >= 2:
+            channel = channel.reduce(factor)
+        channel = np.asarray(channel.resize(size, Image.LANCZOS))
+        if limit is not None:
+            channel = np.clip(np.rint(channel), 0, limit)
+        out[..., c] = channel
+    return out[..., 0] if arr.ndim == 2 else out
+
+
+# ── Décodage / encodage ──────────────────────────────────────────────────────
+def tiff_layout(page):
+    """
+    Interprétation des échantillons d'une page TIFF source (CMYK, alpha,
+    palette...) : à recopier telle quelle à l'écriture, le nombre de canaux
+    ne suffit pas à la retrouver (4 canaux = RGBA ou CMYK).
+    """
+    import tifffile
+    photometric = page.photometric
+    if photometric == tifffile.PHOTOMETRIC.YCBCR:
+        # tifffile décode le YCbCr (JPEG) en RGB
+        photometric = tifffile.PHOTOMETRIC.RGB
+    return {
+        'photometric': int(photometric),
+        'extrasamples': tuple(int(e) for e in page.extrasamples or ()),
+        'inkset': page.tags.valueof(332),
+        'colormap': page.colormap if photometric == tifffile.PHOTOMETRIC.PALETTE else None,
+    }
+
+
+def is_png_compatible(layout):
+    """Les échantillons s'écrivent-ils en PNG (gris / RGB, avec alpha éventuel) ?"""
+    if layout is None:
+        return True
+    import tifffile
+    return layout['photometric'] in (tifffile.PHOTOMETRIC.MINISBLACK, tifffile.PHOTOMETRIC.RGB)
+
+
+def decode_tiff_page(page):
+    """Page TIFF -> tableau (H, W[, C]) à la profondeur native"""
+    import numpy as np
+    import tifffile
+    arr = page.asarray()
+    if page.planarconfig == tifffile.PLANARCONFIG.SEPARATE and arr.ndim == 3:
+        arr = np.moveaxis(arr, 0, -1)
+    return arr
+
+
+def decode_array(path, fmt):
+    """
+    Décode la première image en tableau (H, W[, C]) à la profondeur native.
+    Renvoie (tableau, layout TIFF ou None).
+    """
+    if fmt == 'TIFF':
+        import tifffile
+        with tifffile.TiffFile(path) as tif:
+            page = tif.pages[0]
+            return decode_tiff_page(page), tiff_layout(page)
+    if fmt == 'PNG':
+        import imagecodecs
+        with open(path, 'rb') as f:
+            return imagecodecs.png_decode(f.read()), None
+    raise ValueError(f"Unsupported high bit-depth format: {fmt}")
+
+
+def _png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def _png_insert_chunks(png, chunks):
+    """Insère des chunks juste après IHDR (signature 8 octets + IHDR 25 octets)"""
+    head = 8 + 25
+    return png[:head] + b''.join(chunks) + png[head:]
+
+
+def tiff_write_kwargs(arr, icc_profile=None, dpi=None, layout=None):
+    """Paramètres tifffile ; layout (tiff_layout de la source) prime sur le nombre de canaux"""
+    samples = arr.shape[2] if arr.ndim == 3 else 1
+    kwargs = {
+        'compression': 'lzw',
+        'predictor': True,
+    }
+    if layout is not None:
+        kwargs['photometric'] = layout['photometric']
+        if samples > 1:
+            kwargs['planarconfig'] = 'contig'
+        if layout['extrasamples']:
+            kwargs['extrasamples'] = layout['extrasamples']
+        if layout['inkset'] is not None:
+            kwargs['extratags'] = [(332, 'H', 1, int(layout['inkset']), True)]
+        if layout['colormap'] is not None:
+            kwargs['colormap'] = layout['colormap']
+    else:
+        kwargs['photometric'] = 'rgb' if samples >= 3 else 'minisblack'
+        if samples in (2, 4):
+            kwargs['extrasamples'] = ['unassalpha']
+    if icc_profile:
+        kwargs['iccprofile'] = icc_profile
+    if dpi:
+        kwargs['resolution'] = (float(dpi[0]), float(dpi[1]))
+        kwargs['resolutionunit'] = 'INCH'
+    return kwargs
+
+
+def write_tiff(path, arr, icc_profile=None, dpi=None, layout=None):
+    import tifffile
+    tifffile.imwrite(path, arr, **tiff_write_kwargs(arr, icc_profile, dpi, layout))
+
+
+def encode_png(arr, icc_profile=None, dpi=None):
+    import numpy as np
+    import imagecodecs
+    png = imagecodecs.png_encode(np.ascontiguousarray(arr), level=1)
+    chunks = []
+    if icc_profile:
+        chunks.append(_png_chunk(b'iCCP', b'ICC Profile\x00\x00' + zlib.compress(icc_profile)))
+    if dpi:
+        ppm = [int(round(float(d) / 0.0254)) for d in dpi]
+        chunks.append(_png_chunk(b'pHYs', struct.pack('>IIB', ppm[0], ppm[1], 1)))
+    return _png_insert_chunks(png, chunks)
+
+
+def write_png(path, arr, icc_profile=None, dpi=None):
+    with open(path, 'wb') as f:
+        f.write(encode_png(arr, icc_profile, dpi))
+
+
+class HighBitDepthProcessor:
+    """Même interface que ImageProcessor.crop_image, sans perte de profondeur"""
+
+    preserves_high_bit_depth = True
+    # Sorties TIFF/PNG sans perte : pas d'encodage sous max_bytes
+    last_encode = None
+
+    def crop_image(self, path_in, path_out, focus_x=0.5, focus_y=0.5, zoom=1.0, orientation='portrait',
+                   print_size=None, dpi=None, max_edge=None, max_bytes=None, cancelled=None):
+        try:
+            # Métadonnées via Pillow (en-têtes uniquement, pixels non décodés)
+            with open_image(path_in) as img:
+                original_format = img.format
+                icc_profile = img.info.get('icc_profile')
+                source_dpi = img.info.get('dpi')
+                exif_orientation = ImageProcessor()._get_exif_orientation(img)
+
+            arr, layout = decode_array(path_in, original_format)
+            arr = apply_orientation(arr, exif_orientation)
+            if exif_orientation != 1:
+                logger.info(f"Applied EXIF orientation correction (view): {exif_orientation}")
+
+            h, w = arr.shape[:2]
+            logger.info(f"Processing {original_format} image (NumPy {arr.dtype}): {w}x{h}, shape: {arr.shape}")
+            logger.info(f"Crop settings: orientation={orientation}, zoom={zoom}, focus=({focus_x}, {focus_y})")
+
+            box = compute_crop_box(w, h, focus_x, focus_y, zoom, orientation)
+            cropped = crop_array(arr, box)
+
+            # Redimensionnement éventuel (format d'impression / bord max)
+            crop_size = (cropped.shape[1], cropped.shape[0])
+            output_size, output_dpi = compute_output_size(*crop_size, print_size, dpi, max_edge)
+            if output_size != crop_size:
+                logger.info(f"Resizing for output: {crop_size} -> {output_size}, dpi: {output_dpi}")
+                cropped = downscale_array(cropped, output_size)
+            out_dpi = (output_dpi, output_dpi) if output_dpi else source_dpi
+
+            if cancelled is not None and cancelled.is_set():
+                logger.info("Crop cancelled before encoding")
+                return False
+
+            if original_format == 'TIFF':
+                write_tiff(path_out, cropped, icc_profile, out_dpi, layout)
+            else:
+                write_png(path_out, cropped, icc_profile, out_dpi)
+
+            output_size = os.path.getsize(path_out)
+            logger.info(
+                f"Successfully cropped image: {cropped.shape[1]}x{cropped.shape[0]} {cropped.dtype}, "
+                f"output size: {output_size/1024/1024:.2f} MB"
+            )
+            return True
+
+        except Exception as e:
+            logger.error(f"Error cropping high bit-depth image: {str(e)}", exc_info=True)
+            return False
@@ -1,14 +1,429 @@
 import os
+import io
+import math
 import logging
-from PIL import Image, ImageCms, ImageOps
+import threading
+from PIL import Image
 from PIL.ExifTags import TAGS
-from pillow_heif import register_heif_opener
 
-register_heif_opener()
 logger = logging.getLogger(__name__)
 
+# ── Chargement paresseux HEIF / ICC ───────────────────────────────────────────
+# pillow_heif et ImageCms (lcms2) coûtent cher à l'import : on ne les charge
+# qu'au premier fichier HEIC/HEIF ou au premier profil ICC rencontré.
+HEIF_EXTENSIONS = ('.heic', '.heif')
+
+_heif_lock = threading.Lock()
+_heif_registered = False
+
+
+def ensure_heif_support():
+    """Enregistre l'opener HEIF dans Pillow (une seule fois par process)"""
+    global _heif_registered
+    if _heif_registered:
+        return
+    with _heif_lock:
+        if not _heif_registered:
+            from pillow_heif import register_heif_opener
+            register_heif_opener()
+            _heif_registered = True
+            logger.info("HEIF opener registered")
+
+
+def open_image(path):
+    """Image.open, en activant le support HEIF seulement si nécessaire"""
+    if str(path).lower().endswith(HEIF_EXTENSIONS):
+        ensure_heif_support()
+    return Image.open(path)
+
+
+def _image_cms():
+    from PIL import ImageCms
+    return ImageCms
+
+
+def warmup():
+    """
+    Amorce les codecs (JPEG/PNG/WebP/TIFF), lcms2 et HEIF.
+    Appelé dans le master gunicorn avant le fork pour que les workers
+    héritent de modules déjà chargés.
+    """
+    ensure_heif_support()
+    ImageCms = _image_cms()
+    ImageCms.createProfile('sRGB')
+
+    sample = Image.new('RGB', (16, 16), (128, 128, 128))
+    for fmt, kwargs in (
+        ('JPEG', {'quality': 90}),
+        ('PNG', {'compress_level': 1}),
+        ('WEBP', {'quality': 90}),
+        ('TIFF', {'compression': 'tiff_lzw'}),
+    ):
+        try:
+            buf = io.BytesIO()
+            sample.save(buf, format=fmt, **kwargs)
+            buf.seek(0)
+            with Image.open(buf) as img:
+                img.load()
+        except Exception as e:
+            logger.warning(f"Warm-up failed for {fmt}: {e}")
+    logger.info("Image codecs warmed up")
+
+SIXTEEN_BIT_MODES = ['I;16', 'I;16L', 'I;16B']
+
+
+def probe_bit_depth(img):
+    """
+    Profondeur native par canal, lue dans les en-têtes sans décoder les pixels.
+    Pillow ouvre les TIFF RGB 16 bits et les PNG 16 bits en mode 8 bits :
+    img.mode ne suffit donc pas.
+    """
+    try:
+        if img.format == 'TIFF':
+            bits = img.tag_v2.get(258)  # BitsPerSample
+            if bits:
+                return max(bits) if isinstance(bits, tuple) else int(bits)
+        elif img.format == 'PNG' and img.tile:
+            rawmode = img.tile[0][3]
+            if isinstance(rawmode, tuple):
+                rawmode = rawmode[0]
+            if '16' in str(rawmode):
+                return 16
+    except Exception:
+        pass
+    return 16 if img.mode in SIXTEEN_BIT_MODES else 8
+
+
+def select_processor(meta):
+    """
+    Choisit le moteur de crop d'après les métadonnées de l'upload :
+    moteur NumPy 16 bits pour les TIFF/PNG 16 bits, Pillow sinon.
+    """
+    from utils import highbit_processor
+    if highbit_processor.wants_high_bit_engine(meta):
+        if highbit_processor.is_available():
+            return highbit_processor.HighBitDepthProcessor()
+        logger.warning("16-bit source but numpy/tifffile/imagecodecs unavailable, using Pillow engine")
+    return ImageProcessor()
+
+
+# ── Redimensionnement pour l'impression ──────────────────────────────────────
+DEFAULT_PRINT_DPI = 300
+# reduce() entier tant qu'il reste au moins ce facteur pour la passe Lanczos
+REDUCING_GAP = 2.0
+# Plus grand côté minimal d'une sortie redimensionnée
+MIN_OUTPUT_EDGE = 64
+
+
+def compute_output_size(w, h, print_size=None, dpi=None, max_edge=None):
+    """
+    Taille de sortie (jamais agrandie) et DPI à écrire dans le fichier.
+    print_size : (a, b) en cm, dans n'importe quel ordre (orienté comme le crop).
+    max_edge : plus grand côté en pixels.
+    """
+    scale = 1.0
+    print_inches = None
+    if print_size:
+        dpi = float(dpi or DEFAULT_PRINT_DPI)
+        short_cm, long_cm = sorted(print_size)
+        pw_cm, ph_cm = (long_cm, short_cm) if w >= h else (short_cm, long_cm)
+        print_inches = (pw_cm / 2.54, ph_cm / 2.54)
+        scale = min(scale, print_inches[0] * dpi / w, print_inches[1] * dpi / h)
+    if max_edge:
+        scale = min(scale, max_edge / max(w, h))
+    # Plancher : un format ou des DPI minuscules ne donnent pas une vignette de 1 px
+    scale = max(scale, min(1.0, MIN_OUTPUT_EDGE / max(w, h)))
+
+    size = (w, h)
+    if scale < 1.0:
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+
+    output_dpi = None
+    if print_inches:
+        # DPI effectif : celui demandé si l'on a réduit, moins si la source est trop petite
+        output_dpi = round(min(size[0] / print_inches[0], size[1] / print_inches[1], dpi), 2)
+    elif dpi:
+        output_dpi = float(dpi)
+    return size, output_dpi
+
+
+def downscale(img, size):
+    """Réduction rapide : reduce() entier (moyenne de blocs) puis passe Lanczos finale"""
+    w, h = img.size
+    restore_mode = None
+    if img.mode in SIXTEEN_BIT_MODES:
+        # reduce/resize ne gèrent pas I;16 : passage par I (32 bits) sans perte
+        restore_mode = img.mode
+        img = img.convert('I')
+    elif img.mode == 'P':
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+
+    factor = int(min(w / size[0], h / size[1]) / REDUCING_GAP)
+    if factor >= 2:
+        img = img.reduce(factor)
+    img = img.resize(size, Image.LANCZOS)
+
+    if restore_mode:
+        img = img.convert(restore_mode)
+    return img
+
+
+# ── Encodage sous une taille maximale (JPEG / WebP) ───────────────────────────
+MAX_BYTES_FORMATS = ('JPEG', 'WEBP')
+MAX_BYTES_MIN_QUALITY = 20
+# En dessous, aucune image réelle ne tient (en-têtes, tables de quantification)
+MAX_BYTES_FLOOR = 1024
+# L'échantillon (mosaïque de tuiles pleine résolution) sert à estimer la courbe taille(qualité)
+MAX_BYTES_SAMPLE_PIXELS = 500_000
+# Tuiles multiples de 16 : alignées sur les MCU JPEG / blocs WebP
+MAX_BYTES_SAMPLE_TILE = 128
+# Encodages pleine taille autorisés pour corriger l'estimation
+MAX_BYTES_FULL_ENCODES = 3
+# Les estimations visent un peu sous la limite pour limiter les encodages ratés
+MAX_BYTES_TARGET_RATIO = 0.95
+
+
+def _encode(img, save_kwargs, quality):
+    buf = io.BytesIO()
+    img.save(buf, **dict(save_kwargs, quality=quality))
+    return buf.getvalue()
+
+
+def _mosaic_sample(img, pixels):
+    """
+    Mosaïque de tuiles prises sur une grille régulière, à pleine résolution :
+    contrairement à une réduction, le grain et la texture (donc le coût par
+    pixel) sont conservés.
+    """
+    tile = MAX_BYTES_SAMPLE_TILE
+    grid = max(1, int(math.sqrt(pixels) // tile))
+    sample = Image.new(img.mode, (grid * tile, grid * tile))
+    for row in range(grid):
+        for col in range(grid):
+            left = (img.width - tile) * col // max(grid - 1, 1) // 16 * 16
+            top = (img.height - tile) * row // max(grid - 1, 1) // 16 * 16
+            sample.paste(img.crop((left, top, left + tile, top + tile)), (col * tile, row * tile))
+    return sample
+
+
+def _highest_quality(fits, lo, hi):
+    """Plus grande qualité de [lo, hi] telle que fits(q), ou None (fits supposé monotone)"""
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if fits(mid):
+            best, lo = mid, mid + 1
+        else:
+            hi = mid - 1
+    return best
+
+
+def encode_to_max_bytes(img, save_kwargs, max_bytes, min_quality=MAX_BYTES_MIN_QUALITY):
+    """
+    Encode img (JPEG/WebP) à la plus haute qualité dont le fichier tient dans max_bytes.
+
+    La recherche dichotomique se fait sur une mosaïque de tuiles (_mosaic_sample) :
+    sa taille, multipliée par le rapport de pixels et un facteur de correction,
+    estime la taille pleine résolution. Chaque encodage pleine taille mesure ce
+    facteur pour sa qualité (interpolé entre les qualités mesurées). Après
+    MAX_BYTES_FULL_ENCODES encodages, on ne continue que si aucun n'a tenu
+    dans la limite. Renvoie (data, stats).
+    """
+    hi = int(save_kwargs.get('quality', 95))
+    lo = min(min_quality, hi)
+    stats = {'max_bytes': max_bytes, 'passes': 0, 'sample_passes': 0}
+    smallest = None  # encodage de plus basse qualité, repli si rien ne tient
+
+    def full(q):
+        nonlocal smallest
+        stats['passes'] += 1
+        data = _encode(img, save_kwargs, q)
+        if smallest is None or q < smallest[0]:
+            smallest = (q, data)
+        return data
+
+    best = None
+    if img.width * img.height < 4 * MAX_BYTES_SAMPLE_PIXELS or min(img.size) < MAX_BYTES_SAMPLE_TILE:
+        # Petite image : la dichotomie se fait directement en pleine taille
+        def fits(q):
+            nonlocal best
+            data = full(q)
+            if len(data) <= max_bytes:
+                best = (q, data) if best is None or q > best[0] else best
+                return True
+            return False
+        _highest_quality(fits, lo, hi)
+    else:
+        sample = _mosaic_sample(img, MAX_BYTES_SAMPLE_PIXELS)
+        pixel_ratio = (img.width * img.height) / (sample.width * sample.height)
+        # ICC + EXIF : octets fixes qui ne suivent pas le nombre de pixels
+        overhead = len(save_kwargs.get('icc_profile') or b'') + len(save_kwargs.get('exif') or b'')
+        sample_sizes = {}
+        corrections = {}  # qualité -> taille réelle / taille estimée sans correction
+
+        def sample_size(q):
+            if q not in sample_sizes:
+                stats['sample_passes'] += 1
+                sample_sizes[q] = len(_encode(sample, save_kwargs, q))
+            return sample_sizes[q]
+
+        def correction(q):
+            if not corrections:
+                return 1.0
+            measured = sorted(corrections)
+            if q <= measured[0]:
+                return corrections[measured[0]]
+            if q >= measured[-1]:
+                return corrections[measured[-1]]
+            for a, b in zip(measured, measured[1:]):
+                if a <= q <= b:
+                    t = (q - a) / (b - a)
+                    return corrections[a] * (1 - t) + corrections[b] * t
+
+        def estimate(q):
+            return overhead + max(sample_size(q) - overhead, 0) * pixel_ratio * correction(q)
+
+        while lo <= hi and (stats['passes'] < MAX_BYTES_FULL_ENCODES or best is None):
+            # Sans mesure, on vise sous la limite ; une fois la correction mesurée,
+            # l'estimation est assez fiable pour viser la limite elle-même
+            limit = max_bytes if corrections else max_bytes * MAX_BYTES_TARGET_RATIO
+            q = _highest_quality(lambda q: estimate(q) <= limit, lo, hi)
+            if q is None:
+                # Rien n'est estimé sous la limite : on sonde la plus basse qualité
+                # restante (juste au-dessus de best si une qualité tient déjà)
+                q = lo
+            data = full(q)
+            corrections[q] = max(len(data) - overhead, 1) / (max(sample_size(q) - overhead, 1) * pixel_ratio)
+            if len(data) <= max_bytes:
+                best = (q, data)
+                lo = q + 1
+            else:
+                hi = q - 1
+
+    if best is None:
+        # Même la qualité minimale dépasse : encodage le plus petit, max_bytes_met=False
+        # dans stats (l'API refuse alors la sortie)
+        best = smallest
+
+    quality, data = best
+    stats.update({
+        'quality': quality,
+        'bytes': len(data),
+        'max_bytes_met': len(data) <= max_bytes,
+    })
+    logger.info(
+        f"Encoded under {max_bytes} bytes: quality={quality}, size={len(data)}, "
+        f"full passes={stats['passes']}, sample passes={stats['sample_passes']}"
+    )
+    return data, stats
+
+
+def compute_crop_box(w, h, focus_x=0.5, focus_y=0.5, zoom=1.0, orientation='portrait'):
+    """
+    Calcule la boîte de crop (left, top, right, bottom) au ratio exact 2:3 / 3:2
+    pour une image w x h déjà orientée. Partagée par tous les moteurs de crop.
+    """
+    target_ratio = 2 / 3 if orientation == 'portrait' else 3 / 2
+
+    # Correction du zoom (zoom = 1 => pas de zoom, zoom = 5 => zoom 5x)
+    zoom_factor = 1.0 / max(zoom, 1e-6)
+
+    # Calculer les dimensions de crop en gardant le ratio exact
+    if orientation == 'portrait':
+        # Portrait: largeur = 2, hauteur = 3
+        if (w / h) >= target_ratio:
+            # Image plus large que le ratio cible
+            crop_h = int(h * zoom_factor)
+            crop_w = int(crop_h * target_ratio)
+        else:
+            # Image plus haute que le ratio cible
+            crop_w = int(w * zoom_factor)
+            crop_h = int(crop_w / target_ratio)
+    else:
+        # Landscape: largeur = 3, hauteur = 2
+        if (w / h) >= target_ratio:
+            # Image plus large que le ratio cible
+            crop_h = int(h * zoom_factor)
+            crop_w = int(crop_h * target_ratio)
+        else:
+            # Image plus haute que le ratio cible
+            crop_w = int(w * zoom_factor)
+            crop_h = int(crop_w / target_ratio)
+
+    # S'assurer que les dimensions sont exactement 2:3 ou 3:2
+    if orientation == 'portrait':
+        # Forcer le ratio 2:3
+        if crop_w * 3 != crop_h * 2:
+            crop_h = int(crop_w * 3 / 2)
+    else:
+        # Forcer le ratio 3:2
+        if crop_w * 2 != crop_h * 3:
+            crop_w = int(crop_h * 3 / 2)
+
+    # Calcul du centre et des bordures
+    center_x = int(w * focus_x)
+    center_y = int(h * focus_y)
+
+    left = max(0, center_x - crop_w // 2)
+    top = max(0, center_y - crop_h // 2)
+    right = min(w, left + crop_w)
+    bottom = min(h, top + crop_h)
+
+    # Ajustement des bordures si nécessaire
+    if right > w:
+        left = w - crop_w
+        right = w
+    if bottom > h:
+        top = h - crop_h
+        bottom = h
+    if left < 0:
+        right = crop_w
+        left = 0
+    if top < 0:
+        bottom = crop_h
+        top = 0
+
+    # Vérification finale du ratio
+    final_w, final_h = right - left, bottom - top
+    final_ratio = final_w / final_h
+    expected_ratio = 2/3 if orientation == 'portrait' else 3/2
+
+    logger.info(f"Crop box: {(left, top, right, bottom)}")
+    logger.info(f"Final dimensions: {final_w}x{final_h}, ratio: {final_ratio:.3f}, expected: {expected_ratio:.3f}")
+
+    # Si le ratio n'est pas exact, ajuster
+    if abs(final_ratio - expected_ratio) > 0.01:
+        logger.warning(f"Ratio mismatch detected, adjusting...")
+        if orientation == 'portrait':
+            # Ajuster pour avoir exactement 2:3
+            new_h = final_w * 3 // 2
+            if new_h > final_h:
+                new_w = final_h * 2 // 3
+                right, bottom = left + new_w, top + final_h
+            else:
+                right, bottom = left + final_w, top + new_h
+        else:
+            # Ajuster pour avoir exactement 3:2
+            new_w = final_h * 3 // 2
+            if new_w > final_w:
+                new_h = final_w * 2 // 3
+                right, bottom = left + final_w, top + new_h
+            else:
+                right, bottom = left + new_w, top + final_h
+
+        final_w, final_h = right - left, bottom - top
+        logger.info(f"Adjusted to: {final_w}x{final_h}, ratio: {final_w/final_h:.3f}")
+
+    return (left, top, right, bottom)
+
+
 class ImageProcessor:
+    # Pillow ne conserve 16 bits que pour les modes I;16 (niveaux de gris)
+    preserves_high_bit_depth = False
+
     def __init__(self):
+        # Statistiques du dernier encodage sous max_bytes (qualité, passes)
+        self.last_encode = None
         self.supported_formats = {
             'TIFF': {'extensions': ['.tiff', '.tif'], 'preserve_profile': True},
             'PNG': {'extensions': ['.png'], 'preserve_profile': True},
@@ -29,9 +444,10 @@ class ImageProcessor:
             pass
         return 1
 
-    def _apply_exif_orientation(self, img):
-        """Applique la rotation selon l'orientation EXIF"""
-        orientation = self._get_exif_orientation(img)
+    def _apply_exif_orientation(self, img, orientation=None):
+        """Applique la rotation selon l'orientation EXIF (lue dans img si non fournie)"""
+        if orientation is None:
+            orientation = self._get_exif_orientation(img)
         
         # Mapping des orientations EXIF
         orientation_methods = {
@@ -55,6 +471,7 @@ class ImageProcessor:
         """Analyse le profil ICC pour obtenir des informations détaillées"""
         try:
             if icc_profile:
+                ImageCms = _image_cms()
                 profile = ImageCms.ImageCmsProfile(icc_profile)
                 return {
                     'description': profile.profile.profile_description,
@@ -82,6 +499,7 @@ class ImageProcessor:
                 # Vérifier si le profil n'est pas déjà sRGB
                 if 'sRGB' not in profile_info['description'] and 'sRGB' not in str(profile_info.get('model', '')):
                     logger.info("Converting to sRGB for JPEG output")
+                    ImageCms = _image_cms()
                     # Créer un profil sRGB
                     srgb_profile = ImageCms.createProfile('sRGB')
                     
@@ -95,7 +513,6 @@ class ImageProcessor:
                     )
                     
                     # Obtenir le profil sRGB en bytes
-                    import io
                     srgb_bytes = io.BytesIO()
                     srgb_profile.save(srgb_bytes)
                     return img_converted, srgb_bytes.getvalue()
@@ -107,9 +524,12 @@ class ImageProcessor:
             logger.warning(f"Color profile conversion failed: {e}")
             return img, icc_profile
 
-    def crop_image(self, path_in, path_out, focus_x=0.5, focus_y=0.5, zoom=1.0, orientation='portrait'):
+    def crop_image(self, path_in, path_out, focus_x=0.5, focus_y=0.5, zoom=1.0, orientation='portrait',
+                   print_size=None, dpi=None, max_edge=None, max_bytes=None, cancelled=None):
+        # cancelled : threading.Event optionnel (précalcul abandonné), vérifié avant l'encodage
+        self.last_encode = None
         try:
-            with Image.open(path_in) as img:
+            with open_image(path_in) as img:
                 # Sauvegarde des métadonnées originales
                 original_format = img.format
                 original_mode = img.mode
@@ -120,7 +540,7 @@ class ImageProcessor:
                 img = self._apply_exif_orientation(img)
                 
                 # Pour TIFF 16-bit, préserver le mode
-                is_16bit = original_mode in ['I;16', 'I;16L', 'I;16B']
+                is_16bit = original_mode in SIXTEEN_BIT_MODES
                 
                 # Informations sur le profil couleur
                 profile_info = self._get_color_profile_info(icc_profile)
@@ -131,99 +551,18 @@ class ImageProcessor:
                 logger.info(f"Crop settings: orientation={orientation}, zoom={zoom}, focus=({focus_x}, {focus_y})")
 
                 w, h = img.size
-                target_ratio = 2 / 3 if orientation == 'portrait' else 3 / 2
-
-                # Correction du zoom (zoom = 1 => pas de zoom, zoom = 5 => zoom 5x)
-                zoom_factor = 1.0 / max(zoom, 1e-6)
-
-                # Calculer les dimensions de crop en gardant le ratio exact
-                if orientation == 'portrait':
-                    # Portrait: largeur = 2, hauteur = 3
-                    if (w / h) >= target_ratio:
-                        # Image plus large que le ratio cible
-                        crop_h = int(h * zoom_factor)
-                        crop_w = int(crop_h * target_ratio)
-                    else:
-                        # Image plus haute que le ratio cible
-                        crop_w = int(w * zoom_factor)
-                        crop_h = int(crop_w / target_ratio)
-                else:
-                    # Landscape: largeur = 3, hauteur = 2
-                    if (w / h) >= target_ratio:
-                        # Image plus large que le ratio cible
-                        crop_h = int(h * zoom_factor)
-                        crop_w = int(crop_h * target_ratio)
-                    else:
-                        # Image plus haute que le ratio cible
-                        crop_w = int(w * zoom_factor)
-                        crop_h = int(crop_w / target_ratio)
-                
-                # S'assurer que les dimensions sont exactement 2:3 ou 3:2
-                if orientation == 'portrait':
-                    # Forcer le ratio 2:3
-                    if crop_w * 3 != crop_h * 2:
-                        crop_h = int(crop_w * 3 / 2)
-                else:
-                    # Forcer le ratio 3:2
-                    if crop_w * 2 != crop_h * 3:
-                        crop_w = int(crop_h * 3 / 2)
-
-                # Calcul du centre et des bordures
-                center_x = int(w * focus_x)
-                center_y = int(h * focus_y)
-
-                left = max(0, center_x - crop_w // 2)
-                top = max(0, center_y - crop_h // 2)
-                right = min(w, left + crop_w)
-                bottom = min(h, top + crop_h)
-
-                # Ajustement des bordures si nécessaire
-                if right > w:
-                    left = w - crop_w
-                    right = w
-                if bottom > h:
-                    top = h - crop_h
-                    bottom = h
-                if left < 0:
-                    right = crop_w
-                    left = 0
-                if top < 0:
-                    bottom = crop_h
-                    top = 0
-
-                crop_box = (left, top, right, bottom)
+                crop_box = compute_crop_box(w, h, focus_x, focus_y, zoom, orientation)
                 cropped_img = img.crop(crop_box)
-                
-                # Vérification finale du ratio
-                final_w, final_h = cropped_img.size
-                final_ratio = final_w / final_h
-                expected_ratio = 2/3 if orientation == 'portrait' else 3/2
-                
-                logger.info(f"Crop box: {crop_box}")
-                logger.info(f"Final dimensions: {final_w}x{final_h}, ratio: {final_ratio:.3f}, expected: {expected_ratio:.3f}")
-                
-                # Si le ratio n'est pas exact, ajuster
-                if abs(final_ratio - expected_ratio) > 0.01:
-                    logger.warning(f"Ratio mismatch detected, adjusting...")
-                    if orientation == 'portrait':
-                        # Ajuster pour avoir exactement 2:3
-                        new_h = final_w * 3 // 2
-                        if new_h > final_h:
-                            new_w = final_h * 2 // 3
-                            cropped_img = cropped_img.crop((0, 0, new_w, final_h))
-                        else:
-                            cropped_img = cropped_img.crop((0, 0, final_w, new_h))
-                    else:
-                        # Ajuster pour avoir exactement 3:2
-                        new_w = final_h * 3 // 2
-                        if new_w > final_w:
-                            new_h = final_w * 2 // 3
-                            cropped_img = cropped_img.crop((0, 0, final_w, new_h))
-                        else:
-                            cropped_img = cropped_img.crop((0, 0, new_w, final_h))
-                    
-                    final_w, final_h = cropped_img.size
-                    logger.info(f"Adjusted to: {final_w}x{final_h}, ratio: {final_w/final_h:.3f}")
+
+                # Redimensionnement éventuel (format d'impression / bord max)
+                output_size, output_dpi = compute_output_size(*cropped_img.size, print_size, dpi, max_edge)
+                if output_size != cropped_img.size:
+                    logger.info(f"Resizing for output: {cropped_img.size} -> {output_size}, dpi: {output_dpi}")
+                    cropped_img = downscale(cropped_img, output_size)
+
+                if cancelled is not None and cancelled.is_set():
+                    logger.info("Crop cancelled before encoding")
+                    return False
 
                 # Gestion du profil couleur selon le format de sortie
                 output_format = original_format
@@ -243,11 +582,10 @@ class ImageProcessor:
                 # Gestion spécifique par format
                 if original_format == 'TIFF':
                     if is_16bit:
-                        # Préserver le TIFF 16-bit
+                        # Préserver le TIFF 16-bit (une page ; séquences : SequenceProcessor)
                         save_kwargs.update({
                             'format': 'TIFF',
                             'compression': 'tiff_lzw',
-                            'save_all': True
                         })
                         # S'assurer que le nom de sortie est en .tif
                         if not path_out.lower().endswith(('.tif', '.tiff')):
@@ -303,6 +641,10 @@ class ImageProcessor:
                         'lossless': False
                     })
 
+                # Résolution d'impression (WebP n'a pas de champ DPI dans Pillow)
+                if output_dpi and output_format != 'WEBP':
+                    save_kwargs['dpi'] = (output_dpi, output_dpi)
+
                 # Préservation des profils couleur
                 if final_icc_profile:
                     save_kwargs['icc_profile'] = final_icc_profile
@@ -318,13 +660,23 @@ class ImageProcessor:
                         # Réinitialiser l'orientation à 1 (normale)
                         if 0x0112 in exif:  # 0x0112 est le tag Orientation
                             exif[0x0112] = 1
+                        # Garder XResolution/YResolution cohérents avec le DPI JFIF
+                        if output_dpi:
+                            exif[0x011A] = output_dpi
+                            exif[0x011B] = output_dpi
+                            exif[0x0128] = 2  # pouces
                         save_kwargs['exif'] = exif.tobytes()
                     except:
                         # Si on ne peut pas modifier, on omet l'EXIF
                         logger.warning("Could not modify EXIF orientation tag")
 
                 # Sauvegarde avec les paramètres optimaux
-                final_img.save(path_out, **save_kwargs)
+                if max_bytes and output_format in MAX_BYTES_FORMATS:
+                    data, self.last_encode = encode_to_max_bytes(final_img, save_kwargs, max_bytes)
+                    with open(path_out, 'wb') as f:
+                        f.write(data)
+                else:
+                    final_img.save(path_out, **save_kwargs)
                 
                 # Vérification de la taille du fichier et du profil couleur
                 output_size = os.path.getsize(path_out)
@@ -345,9 +697,23 @@ class ImageProcessor:
             logger.error(f"Error cropping image: {str(e)}", exc_info=True)
             return False
 
+def human_file_size(size_bytes):
+    """Taille lisible (B, KB, MB, GB)"""
+    if size_bytes < 1024:
+        return f"{size_bytes} B"
+    elif size_bytes < 1024**2:
+        return f"{size_bytes/1024:.1f} KB"
+    elif size_bytes < 1024**3:
+        return f"{size_bytes/(1024**2):.1f} MB"
+    return f"{size_bytes/(1024**3):.1f} GB"
+
 def get_image_info(image_path):
     try:
-        with Image.open(image_path) as img:
+        with open_image(image_path) as img:
+            source_format = img.format
+            source_bit_depth = probe_bit_depth(img)
+            frames = getattr(img, 'n_frames', 1)
+
             # Appliquer l'orientation EXIF pour obtenir les bonnes dimensions
             processor = ImageProcessor()
             orientation = processor._get_exif_orientation(img)
@@ -356,20 +722,27 @@ def get_image_info(image_path):
             
             info = {
                 'filename': os.path.basename(image_path),
-                'format': img.format,
+                'format': source_format,
                 'mode': img.mode,
                 'size': img.size,
                 'width': img.width,
                 'height': img.height,
                 'aspect_ratio': round(img.width / img.height, 3),
                 'file_size': os.path.getsize(image_path),
-                'exif_orientation': orientation
+                'exif_orientation': orientation,
+                'frames': frames
             }
 
+            if img.info.get('dpi'):
+                info['dpi'] = [round(float(d), 2) for d in img.info['dpi']]
+
             # Détection du type de couleur et profondeur
-            if img.mode in ['I;16', 'I;16L', 'I;16B']:
+            if img.mode in SIXTEEN_BIT_MODES:
                 info['bit_depth'] = 16
                 info['color_type'] = 'Grayscale 16-bit'
+            elif img.mode in ['RGB', 'RGBA', 'CMYK'] and source_bit_depth == 16:
+                info['bit_depth'] = 16
+                info['color_type'] = f"{img.mode} 16-bit"
             elif img.mode == 'RGB':
                 info['bit_depth'] = 8
                 info['color_type'] = 'RGB 8-bit'
@@ -386,6 +759,7 @@ def get_image_info(image_path):
             # Profil couleur
             if 'icc_profile' in img.info:
                 try:
+                    ImageCms = _image_cms()
                     profile = ImageCms.ImageCmsProfile(img.info['icc_profile'])
                     profile_desc = profile.profile.profile_description
                     info['color_profile'] = profile_desc
@@ -409,15 +783,7 @@ def get_image_info(image_path):
                 info['color_profile_type'] = 'None'
 
             # Taille lisible
-            size_bytes = info['file_size']
-            if size_bytes < 1024:
-                info['file_size_human'] = f"{size_bytes} B"
-            elif size_bytes < 1024**2:
-                info['file_size_human'] = f"{size_bytes/1024:.1f} KB"
-            elif size_bytes < 1024**3:
-                info['file_size_human'] = f"{size_bytes/(1024**2):.1f} MB"
-            else:
-                info['file_size_human'] = f"{size_bytes/(1024**3):.1f} GB"
+            info['file_size_human'] = human_file_size(info['file_size'])
 
             return info
 
@@ -427,7 +793,7 @@ def get_image_info(image_path):
 
 def is_valid_image_format(image_path):
     try:
-        with Image.open(image_path) as img:
+        with open_image(image_path) as img:
             img.verify()
         return True
     except Exception as e:
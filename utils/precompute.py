@@ -0,0 +1,455 @@
+"""
+Précalcul spéculatif des crops par défaut.
+
+Juste après l'upload, la plupart des utilisateurs cliquent sur « Process »
+sans toucher aux réglages (focus 0.5/0.5, zoom 1). Le Precomputer lance ces
+crops en arrière-plan, dans un thread à basse priorité, et /api/process
+récupère le résultat si les paramètres correspondent.
+
+- schedule() refuse le travail quand le worker ou le conteneur est chargé
+  (throttling) : autres requêtes en cours dans le worker, ou CPU du conteneur
+  (quota cgroup) déjà occupé hors précalcul sur la dernière fenêtre ;
+- cancel() abandonne les précalculs d'un upload (réglages modifiés, cleanup) ;
+- claim() récupère un résultat, en attendant un calcul déjà démarré au plus
+  le temps estimé d'un crop direct (le thread du job est alors remonté à la
+  priorité normale) ; au-delà, le job est annulé et la requête calcule ;
+- stats() expose taux de hit et CPU gaspillé de ce process.
+
+Avec plusieurs workers, un précalcul terminé peut être réclamé ou jeté par
+un autre process que celui qui l'a calculé (registre partagé) : ce process
+le comptabilise via record_claimed() / record_discarded(). Les totaux ne sont
+donc justes qu'une fois sommés sur les workers : chaque changement de
+compteur est publié (callback publish, registre partagé) et merge_stats()
+fait la somme.
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+
+# Compteurs cumulés, sommés entre workers par merge_stats()
+COUNTERS = (
+    "scheduled", "throttled", "cancelled", "discarded", "hits", "misses",
+    "cpu_seconds_total", "cpu_seconds_used", "cpu_seconds_wasted",
+)
+
+# Coût d'un crop par mégapixel (secondes CPU) tant qu'aucun job n'a été mesuré
+DEFAULT_SECONDS_PER_MEGAPIXEL = 0.1
+# Attente minimale d'un job démarré (évite d'abandonner un job presque fini)
+MIN_CLAIM_WAIT_SECONDS = 0.5
+
+# Fenêtre de mesure de l'occupation CPU (secondes)
+CPU_WINDOW_SECONDS = 1.0
+
+
+def _read_first(paths):
+    for path in paths:
+        try:
+            with open(path) as f:
+                return f.read()
+        except OSError:
+            continue
+    return None
+
+
+def cpu_quota() -> float:
+    """
+    Nombre de CPU réellement disponibles : quota cgroup v2 (cpu.max) ou v1
+    (cfs_quota_us / cfs_period_us), borné par l'affinité du process.
+    os.cpu_count() compte les CPU de l'hôte, pas ceux du conteneur.
+    """
+    try:
+        available = float(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        available = float(os.cpu_count() or 1)
+
+    quota = None
+    raw = _read_first(["/sys/fs/cgroup/cpu.max"])
+    if raw:
+        fields = raw.split()
+        if len(fields) >= 2 and fields[0] != "max":
+            quota = int(fields[0]) / int(fields[1])
+    else:
+        raw_quota = _read_first(["/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us"])
+        raw_period = _read_first(["/sys/fs/cgroup/cpu/cpu.cfs_period_us", "/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us"])
+        if raw_quota and raw_period and int(raw_quota) > 0:
+            quota = int(raw_quota) / int(raw_period)
+    return min(quota, available) if quota else available
+
+
+def _cgroup_cpu_seconds():
+    """CPU consommé par tout le conteneur (cgroup v2 puis v1), None si illisible"""
+    raw = _read_first(["/sys/fs/cgroup/cpu.stat"])
+    if raw:
+        for line in raw.splitlines():
+            if line.startswith("usage_usec "):
+                return int(line.split()[1]) / 1e6
+    raw = _read_first(["/sys/fs/cgroup/cpuacct/cpuacct.usage", "/sys/fs/cgroup/cpu,cpuacct/cpuacct.usage"])
+    if raw:
+        return int(raw) / 1e9
+    return None
+
+
+class _CpuMonitor:
+    """
+    Part du quota CPU occupée hors précalcul, sur la dernière fenêtre.
+    Source : compteur cgroup du conteneur (tous les workers), sinon os.times()
+    de ce process. Le CPU des threads de précalcul de ce process est retiré.
+    """
+
+    def __init__(self, window=CPU_WINDOW_SECONDS):
+        self.window = window
+        self.quota = cpu_quota()
+        self._sample = None  # (instant, CPU consommé, CPU de précalcul)
+        self._busy = 0.0
+
+    @staticmethod
+    def _consumed():
+        used = _cgroup_cpu_seconds()
+        if used is None:
+            times = os.times()
+            used = times.user + times.system
+        return used
+
+    def busy(self, precompute_cpu):
+        """Occupation (fraction du quota) ; échantillonnée au plus une fois par fenêtre"""
+        now = time.monotonic()
+        if self._sample is None:
+            self._sample = (now, self._consumed(), precompute_cpu)
+            return self._busy
+        start, used, precomputed = self._sample
+        if now - start >= self.window:
+            consumed = self._consumed()
+            other = (consumed - used) - (precompute_cpu - precomputed)
+            self._busy = max(0.0, other) / ((now - start) * self.quota)
+            self._sample = (now, consumed, precompute_cpu)
+        return self._busy
+
+
+class _Job:
+    __slots__ = ("future", "cancelled", "discard", "cpu", "created", "origin", "megapixels", "tid")
+
+    def __init__(self, discard, origin, megapixels):
+        self.future = None
+        self.cancelled = threading.Event()
+        self.discard = discard
+        self.cpu = 0.0
+        self.created = time.time()
+        self.origin = origin  # requête qui a planifié le job
+        self.megapixels = megapixels
+        self.tid = None  # thread natif pendant l'exécution
+
+
+class Precomputer:
+    """Planificateur de précalculs, local au process (un pool par pid)"""
+
+    def __init__(self, enabled=True, max_workers=1, max_pending=4, max_active_requests=0,
+                 max_load=0.75, nice=10, ttl_seconds=1800, publish=None):
+        """
+        max_active_requests : autres requêtes en cours tolérées dans le worker
+        (hors celle qui planifie) ; 0 = tout trafic concurrent suspend le précalcul.
+        max_load : occupation CPU hors précalcul (fraction du quota) au-delà de
+        laquelle on ne précalcule pas ; 0 désactive ce critère.
+        publish(pid, stats) : appelé à chaque changement de compteur.
+        """
+        self.enabled = enabled
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_active_requests = max_active_requests
+        self.max_load = max_load
+        self.nice = nice
+        self.ttl_seconds = ttl_seconds
+        self.publish = publish
+
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._jobs = {}  # (upload, variante) -> _Job
+        self._executor = None
+        self._pid = None
+        self._active = set()  # jetons des requêtes en cours
+        self._local = threading.local()
+        self._clocks = []  # horloges CPU des threads de précalcul
+        self._cpu = _CpuMonitor()
+        self._seconds_per_megapixel = DEFAULT_SECONDS_PER_MEGAPIXEL
+        self._stats = dict.fromkeys(COUNTERS, 0)
+
+    # ── Compteurs ─────────────────────────────────────────────────────────────
+    def _count(self, **deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self._stats[key] += delta
+        self._publish()
+
+    def _publish(self):
+        if self.publish is None:
+            return
+        # Sérialisé : le dernier instantané écrit est toujours le plus récent
+        with self._publish_lock:
+            try:
+                self.publish(os.getpid(), self.stats())
+            except Exception as e:
+                logger.warning(f"Precompute stats not published: {e}")
+
+    # ── Charge ────────────────────────────────────────────────────────────────
+    def request_started(self):
+        token = object()
+        self._local.request = token
+        with self._lock:
+            self._active.add(token)
+            # garde la fenêtre de mesure CPU à jour tant qu'il y a du trafic
+            self._cpu.busy(self._precompute_cpu())
+
+    def request_finished(self):
+        token = getattr(self._local, "request", None)
+        self._local.request = None
+        with self._lock:
+            self._active.discard(token)
+
+    def _precompute_cpu(self):
+        """CPU consommé par les threads de précalcul de ce process (en cours compris)"""
+        total = 0.0
+        for clock in self._clocks:
+            try:
+                total += time.clock_gettime(clock)
+            except OSError:
+                pass
+        return total
+
+    def _overloaded(self, origin=None):
+        # la requête qui planifie (upload) ne compte pas
+        if len(self._active - {origin}) > self.max_active_requests:
+            return True
+        if self.max_load and self._cpu.busy(self._precompute_cpu()) > self.max_load:
+            return True
+        return False
+
+    # ── Pool d'exécution ──────────────────────────────────────────────────────
+    @staticmethod
+    def _set_nice(tid, nice=None):
+        # Sous Linux, setpriority sur le tid ne touche que ce thread. Remonter
+        # la priorité (baisser nice) demande CAP_SYS_NICE : échec toléré.
+        # nice=None : priorité du thread appelant
+        try:
+            if nice is None:
+                nice = os.getpriority(os.PRIO_PROCESS, 0)
+            os.setpriority(os.PRIO_PROCESS, tid, nice)
+            return True
+        except (AttributeError, OSError):
+            return False
+
+    def _init_thread(self):
+        self._set_nice(threading.get_native_id(), self.nice)
+        try:
+            clock = time.pthread_getcpuclockid(threading.get_ident())
+        except (AttributeError, OSError):
+            return
+        with self._lock:
+            self._clocks.append(clock)
+
+    def _get_executor(self):
+        # Les threads ne survivent pas au fork (preload gunicorn) : un pool par pid
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="precompute",
+                initializer=self._init_thread,
+            )
+            self._pid = os.getpid()
+            self._jobs.clear()
+            self._clocks = []
+            self._cpu = _CpuMonitor()
+        return self._executor
+
+    def _pending(self):
+        return sum(1 for job in self._jobs.values() if not job.future.done())
+
+    # ── API ───────────────────────────────────────────────────────────────────
+    def schedule(self, key, fn, discard=None, megapixels=None):
+        """
+        Planifie fn(cancelled_event) -> résultat (ou None) sous la clé (upload, variante).
+        discard(résultat) est appelé si le résultat n'est jamais réclamé.
+        megapixels (taille de la source) sert à estimer le coût d'un crop direct.
+        Renvoie False si le précalcul est désactivé ou refusé pour cause de charge.
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            executor = self._get_executor()
+            self._expire_locked()
+            origin = getattr(self._local, "request", None)
+            throttled = self._overloaded(origin) or self._pending() >= self.max_pending
+            if not throttled:
+                job = _Job(discard, origin, megapixels)
+                job.future = executor.submit(self._run, job, fn)
+                self._jobs[key] = job
+        if throttled:
+            self._count(throttled=1)
+            return False
+        self._count(scheduled=1)
+        return True
+
+    def _run(self, job, fn):
+        if job.cancelled.is_set():
+            return None
+        # La charge a pu monter depuis la planification
+        with self._lock:
+            throttled = self._overloaded(job.origin)
+        if throttled:
+            job.cancelled.set()
+            self._count(throttled=1)
+            return None
+
+        with self._lock:
+            job.tid = threading.get_native_id()
+        start = time.thread_time()
+        result = None
+        try:
+            result = fn(job.cancelled)
+        except Exception as e:
+            logger.warning(f"Precompute job failed: {e}")
+        finally:
+            job.cpu = time.thread_time() - start
+            with self._lock:
+                # claim() a pu remonter la priorité : retour à nice pour le job suivant
+                job.tid = None
+                self._set_nice(threading.get_native_id(), self.nice)
+                if result is not None and job.megapixels:
+                    # moyenne glissante du coût d'un crop, CPU indépendant du nice
+                    rate = job.cpu / job.megapixels
+                    self._seconds_per_megapixel += 0.3 * (rate - self._seconds_per_megapixel)
+            self._count(cpu_seconds_total=job.cpu)
+
+        # Abandonné pendant le calcul (ou échec) : le CPU est perdu
+        if result is None or job.cancelled.is_set():
+            self._drop(job, result)
+            return None
+        return result
+
+    def _drop(self, job, result):
+        self._count(cpu_seconds_wasted=job.cpu)
+        if result is not None and job.discard:
+            try:
+                job.discard(result)
+            except Exception:
+                pass
+
+    def _cancel_job(self, job):
+        """Annule un job retiré de self._jobs (appelé hors verrou)"""
+        job.cancelled.set()
+        if not job.future.cancel() and job.future.done():
+            result = job.future.result()
+            if result is not None:
+                self._drop(job, result)
+        # En cours : _run verra le drapeau et jettera le résultat
+        self._count(cancelled=1)
+
+    def cancel(self, upload):
+        """Annule tous les précalculs d'un upload ; renvoie le nombre de jobs annulés"""
+        with self._lock:
+            keys = [k for k in self._jobs if k[0] == upload]
+            jobs = [self._jobs.pop(k) for k in keys]
+        for job in jobs:
+            self._cancel_job(job)
+        return len(jobs)
+
+    def claim(self, key, timeout=30.0):
+        """
+        Récupère le résultat précalculé pour key, ou None.
+        Un job encore en file est annulé (recalculer en direct est plus rapide
+        qu'attendre son tour). Un job démarré repasse à la priorité normale et
+        est attendu au plus le temps estimé d'un crop direct (borné par timeout) :
+        au-delà, il est annulé et l'appelant calcule lui-même.
+        """
+        with self._lock:
+            job = self._jobs.pop(key, None)
+            if job is not None and job.tid is not None:
+                # la requête attend ce job : il ne doit plus céder le CPU
+                self._set_nice(job.tid)
+            rate = self._seconds_per_megapixel
+        if job is None:
+            return None
+        if job.future.cancel():
+            self._count(cancelled=1)
+            return None
+        if job.megapixels:
+            timeout = min(timeout, max(MIN_CLAIM_WAIT_SECONDS, rate * job.megapixels))
+        try:
+            result = job.future.result(timeout=timeout)
+        except FutureTimeout:
+            job.cancelled.set()
+            self._count(cancelled=1)
+            return None
+        if result is not None:
+            self._count(cpu_seconds_used=job.cpu)
+        return result
+
+    def record_lookup(self, hit):
+        """Comptabilise une requête aux paramètres par défaut (hit ou miss)"""
+        self._count(**{"hits" if hit else "misses": 1})
+
+    def record_claimed(self, cpu_seconds):
+        """Résultat calculé par un autre worker, réclamé ici via le registre"""
+        self._count(cpu_seconds_used=cpu_seconds)
+
+    def record_discarded(self, cpu_seconds):
+        """Résultat terminé retiré du registre sans être réclamé (cleanup, annulation, TTL)"""
+        self._count(discarded=1, cpu_seconds_wasted=cpu_seconds)
+
+    def _expire_locked(self):
+        # Jobs terminés et jamais réclamés : leur résultat est compté comme
+        # gaspillé quand le registre le retire (record_discarded), pas ici
+        cutoff = time.time() - self.ttl_seconds
+        for key in [k for k, j in self._jobs.items() if j.created < cutoff and j.future.done()]:
+            del self._jobs[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = self._pending() if self._executor else 0
+            stats["active_requests"] = len(self._active)
+            stats["cpu_busy"] = round(self._cpu.busy(self._precompute_cpu()), 3)
+            stats["cpu_quota"] = self._cpu.quota
+            stats["seconds_per_megapixel"] = round(self._seconds_per_megapixel, 4)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+        for k in ("cpu_seconds_total", "cpu_seconds_used", "cpu_seconds_wasted"):
+            stats[k] = round(stats[k], 3)
+        stats["enabled"] = self.enabled
+        return stats
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        pass
+    return True
+
+
+def merge_stats(per_worker):
+    """
+    Somme les stats publiées par chaque worker ({pid: stats}). Les compteurs
+    des workers terminés (recyclés par gunicorn) restent comptés ; leurs
+    pending / active_requests, eux, ne le sont plus.
+    """
+    merged = dict.fromkeys(COUNTERS, 0)
+    merged["pending"] = 0
+    merged["active_requests"] = 0
+    for pid, stats in per_worker.items():
+        for key in COUNTERS:
+            merged[key] += stats.get(key, 0)
+        if _pid_alive(pid):
+            merged["pending"] += stats.get("pending", 0)
+            merged["active_requests"] += stats.get("active_requests", 0)
+    lookups = merged["hits"] + merged["misses"]
+    merged["hit_rate"] = round(merged["hits"] / lookups, 3) if lookups else None
+    for k in ("cpu_seconds_total", "cpu_seconds_used", "cpu_seconds_wasted"):
+        merged[k] = round(merged[k], 3)
+    merged["workers"] = {str(pid): stats for pid, stats in sorted(per_worker.items())}
+    return merged
@@ -0,0 +1,205 @@
+"""
+Crop image par image des séquences : TIFF multi-pages et conteneurs HEIF
+multi-images (rafales, plus les images de profondeur associées).
+
+Les frames sont décodées une à une (seek), recadrées avec la même géométrie
+relative (compute_crop_box sur la taille de chaque frame), écrites, puis
+libérées avant de décoder la suivante : la mémoire reste celle d'une frame,
+quel que soit le nombre de pages.
+
+Sorties : TIFF multi-pages (pages ajoutées au fil de l'eau) ou ZIP de frames.
+"""
+import io
+import os
+import logging
+import zipfile
+
+from PIL import TiffImagePlugin
+
+from utils.image_processor import (
+    SIXTEEN_BIT_MODES,
+    ImageProcessor,
+    compute_crop_box,
+    compute_output_size,
+    downscale,
+    open_image,
+)
+
+logger = logging.getLogger(__name__)
+
+SEQUENCE_OUTPUTS = ('tiff', 'zip')
+SEQUENCE_EXTENSIONS = {'tiff': '.tif', 'zip': '.zip'}
+# Modes encodés en PNG dans le ZIP (alpha, 16 bits, palette), JPEG sinon
+PNG_FRAME_MODES = set(SIXTEEN_BIT_MODES) | {'I', 'RGBA', 'LA', 'P', 'PA'}
+
+
+def default_sequence_output(fmt):
+    """TIFF multi-pages pour les TIFF, ZIP pour le reste (HEIF...)"""
+    return 'tiff' if fmt == 'TIFF' else 'zip'
+
+
+def _frame_orientation(frame):
+    # Les tags TIFF suivent la page courante ; getexif() peut rester en cache
+    tags = getattr(frame, 'tag_v2', None)
+    if tags is not None:
+        return tags.get(0x0112, 1)
+    return ImageProcessor()._get_exif_orientation(frame)
+
+
+def iter_frames(img):
+    """
+    Parcourt les frames de img sans les garder en mémoire : (nom, image).
+    Pour HEIF, les images de profondeur de chaque frame suivent celle-ci.
+    """
+    for index in range(getattr(img, 'n_frames', 1)):
+        img.seek(index)
+        name = f"frame_{index + 1:03d}"
+        yield name, img
+        for depth_index, depth in enumerate(img.info.get('depth_images') or []):
+            yield f"{name}_depth_{depth_index + 1}", depth.to_pillow()
+
+
+class SequenceProcessor:
+    """Crop de toutes les frames d'un fichier, en flux"""
+
+    def __init__(self, high_bit=False):
+        # high_bit : TIFF 16 bits/canal décodés par tifffile (page par page)
+        self.high_bit = high_bit
+        self.processor = ImageProcessor()
+        self.last_summary = None
+
+    def crop_sequence(self, path_in, path_out, focus_x=0.5, focus_y=0.5, zoom=1.0, orientation='portrait',
+                      output='tiff', print_size=None, dpi=None, max_edge=None):
+        self.last_summary = {'frames': 0, 'output': output, 'frame_sizes': []}
+        geometry = dict(focus_x=focus_x, focus_y=focus_y, zoom=zoom, orientation=orientation,
+                        print_size=print_size, dpi=dpi, max_edge=max_edge)
+        try:
+            logger.info(f"Sequence crop: output={output}, high_bit={self.high_bit}, settings={geometry}")
+            if self.high_bit:
+                self._crop_high_bit(path_in, path_out, output, **geometry)
+            else:
+                with open_image(path_in) as img:
+                    icc_profile = img.info.get('icc_profile')
+                    frames = self._cropped_frames(img, **geometry)
+                    if output == 'tiff':
+                        self._write_tiff(frames, path_out, icc_profile)
+                    else:
+                        self._write_zip(frames, path_out, icc_profile)
+
+            logger.info(
+                f"Successfully cropped {self.last_summary['frames']} frames, "
+                f"output size: {os.path.getsize(path_out)/1024/1024:.2f} MB"
+            )
+            return self.last_summary['frames'] > 0
+
+        except Exception as e:
+            logger.error(f"Error cropping sequence: {str(e)}", exc_info=True)
+            return False
+
+    # ── Moteur Pillow ─────────────────────────────────────────────────────────
+    def _cropped_frames(self, img, focus_x, focus_y, zoom, orientation, print_size, dpi, max_edge):
+        for name, frame in iter_frames(img):
+            oriented = self.processor._apply_exif_orientation(frame, _frame_orientation(frame))
+
+            box = compute_crop_box(*oriented.size, focus_x, focus_y, zoom, orientation)
+            cropped = oriented.crop(box)
+            del oriented
+
+            size, output_dpi = compute_output_size(*cropped.size, print_size, dpi, max_edge)
+            if size != cropped.size:
+                cropped = downscale(cropped, size)
+
+            self._count(cropped.size)
+            yield name, cropped, output_dpi
+            del cropped
+
+    def _count(self, size):
+        self.last_summary['frames'] += 1
+        self.last_summary['frame_sizes'].append(list(size))
+
+    def _write_tiff(self, frames, path_out, icc_profile):
+        # AppendingTiffWriter : chaque page est écrite puis oubliée
+        # (Image.save(save_all=True) matérialise toutes les pages d'abord)
+        with open(path_out, 'w+b') as fp, TiffImagePlugin.AppendingTiffWriter(fp) as tf:
+            for _, frame, output_dpi in frames:
+                save_kwargs = {'format': 'TIFF', 'compression': 'tiff_lzw'}
+                if icc_profile and frame.mode not in ('P', 'PA'):
+                    save_kwargs['icc_profile'] = icc_profile
+                if output_dpi:
+                    save_kwargs['dpi'] = (output_dpi, output_dpi)
+                buf = io.BytesIO()
+                frame.save(buf, **save_kwargs)
+                tf.write(buf.getvalue())
+                tf.newFrame()
+
+    def _write_zip(self, frames, path_out, icc_profile):
+        # Frames déjà compressées : ZIP en mode stocké
+        with zipfile.ZipFile(path_out, 'w', compression=zipfile.ZIP_STORED) as zf:
+            for name, frame, output_dpi in frames:
+                buf = io.BytesIO()
+                if frame.mode in PNG_FRAME_MODES:
+                    ext, save_kwargs = '.png', {'format': 'PNG', 'compress_level': 1}
+                else:
+                    if frame.mode not in ('RGB', 'L', 'CMYK'):
+                        frame = frame.convert('RGB')
+                    ext, save_kwargs = '.jpg', {
+                        'format': 'JPEG',
+                        'quality': 98,
+                        'optimize': True,
+                        'progressive': True,
+                        'subsampling': 0,
+                    }
+                # Les images de profondeur n'ont pas le profil couleur de la frame
+                if icc_profile and '_depth_' not in name and frame.mode not in ('P', 'PA'):
+                    save_kwargs['icc_profile'] = icc_profile
+                if output_dpi:
+                    save_kwargs['dpi'] = (output_dpi, output_dpi)
+                frame.save(buf, **save_kwargs)
+                zf.writestr(name + ext, buf.getvalue())
+
+    # ── Moteur NumPy 16 bits (TIFF) ───────────────────────────────────────────
+    def _crop_high_bit(self, path_in, path_out, output, focus_x, focus_y, zoom, orientation,
+                       print_size, dpi, max_edge):
+        import tifffile
+        from utils.highbit_processor import (
+            apply_orientation,
+            crop_array,
+            decode_tiff_page,
+            downscale_array,
+            encode_png,
+            is_png_compatible,
+            tiff_layout,
+            tiff_write_kwargs,
+        )
+
+        with tifffile.TiffFile(path_in) as tif:
+            tif.pages.cache = False  # ne pas garder les pages déjà lues
+            writer = tifffile.TiffWriter(path_out, bigtiff=tif.is_bigtiff) if output == 'tiff' else \
+                zipfile.ZipFile(path_out, 'w', compression=zipfile.ZIP_STORED)
+            with writer:
+                for index, page in enumerate(tif.pages):
+                    icc_profile = page.tags.valueof(34675)
+                    layout = tiff_layout(page)
+                    arr = apply_orientation(decode_tiff_page(page), page.tags.valueof(274, 1))
+
+                    box = compute_crop_box(arr.shape[1], arr.shape[0], focus_x, focus_y, zoom, orientation)
+                    cropped = crop_array(arr, box)
+                    crop_size = (cropped.shape[1], cropped.shape[0])
+                    size, output_dpi = compute_output_size(*crop_size, print_size, dpi, max_edge)
+                    if size != crop_size:
+                        cropped = downscale_array(cropped, size)
+                    out_dpi = (output_dpi, output_dpi) if output_dpi else None
+
+                    name = f"frame_{index + 1:03d}"
+                    if output == 'tiff':
+                        writer.write(cropped, **tiff_write_kwargs(cropped, icc_profile, out_dpi, layout))
+                    elif is_png_compatible(layout):
+                        writer.writestr(f"{name}.png", encode_png(cropped, icc_profile, out_dpi))
+                    else:
+                        # CMYK, palette, Lab... : pas d'équivalent PNG, frame en TIFF
+                        buf = io.BytesIO()
+                        tifffile.imwrite(buf, cropped, **tiff_write_kwargs(cropped, icc_profile, out_dpi, layout))
+                        writer.writestr(f"{name}.tif", buf.getvalue())
+
+                    self._count((cropped.shape[1], cropped.shape[0]))
+                    del arr, cropped